@@ -35,5 +35,8 @@ import tensorlight.mathex
 import tensorlight.model
 import tensorlight.network
 # import tensorlight.recurrent
+import tensorlight.serving
 import tensorlight.training
-import tensorlight.visualization
+
+# visualization requires matplotlib and IPython, so it is imported on first access
+visualization = tensorlight.utils.lazy.LazyModule(__name__ + ".visualization")
@@ -79,33 +79,187 @@ def loss_summary(losses, decay=0.9):
     return loss_averages_op
 
 
-def variables_histogram_summary():
+def _downsample(x, max_elements):
+    """Downsamples a tensor to a flat tensor with at most max_elements values using
+       a strided slice, to reduce the data that has to be copied to the host.
+    Parameters
+    ----------
+    x: Tensor or Variable
+        The tensor to downsample.
+    max_elements: int or None
+        The maximum number of elements, or None to not downsample.
+    Returns
+    ----------
+    The (downsampled) tensor.
+    """
+    if max_elements is None:
+        return x
+    
+    size = x.get_shape().num_elements()
+    if size is None or size <= max_elements:
+        return x
+    
+    stride = int(math.ceil(float(size) / max_elements))
+    with tf.name_scope("downsample"):
+        return tf.reshape(x, [-1])[::stride]
+
+
+def variables_histogram_summary(collection=tf.GraphKeys.TRAINABLE_VARIABLES,
+                                name_filter=None, max_elements=None):
     """Creates a full histogram summary for every trainable variable.
+    Parameters
+    ----------
+    collection: str, optional
+        The graph collection of the variables.
+    name_filter: function or None, optional
+        A function with signature name_filter(name) that returns whether a histogram
+        of the variable should be created, or None to use all variables.
+    max_elements: int or None, optional
+        The maximum number of elements of a variable to use for its histogram. Larger
+        variables are downsampled on their device, before these are copied to the CPU.
     Returns
     ----------
     A list of string tensors that can ba added to a summary.
     """
-    with tf.device('/cpu:0'):
-        for var in tf.trainable_variables():
-            yield tf.summary.histogram(var.op.name, var)
+    for var in tf.get_collection(collection):
+        if name_filter is not None and not name_filter(var.op.name):
+            continue
+        values = _downsample(var, max_elements)
+        with tf.device('/cpu:0'):
+            yield tf.summary.histogram(var.op.name, values)
 
         
-def gradients_histogram_summary(gradients):
+def gradients_histogram_summary(gradients, name_filter=None, max_elements=None):
     """Creates a histogramm summary for all given gradients.
     Parameters
     ----------
     gradients: list[(gradient, variable)]
         A list of (gradient, variable) pairs created by Optimizer.compute_gradients().
+    name_filter: function or None, optional
+        A function with signature name_filter(name) that returns whether a histogram
+        of the gradient should be created, or None to use all gradients.
+    max_elements: int or None, optional
+        The maximum number of elements of a gradient to use for its histogram. Larger
+        gradients are downsampled on their device, before these are copied to the CPU.
     Returns
     ----------
     A list of string tensors that can ba added to a summary.
     """
-    with tf.device('/cpu:0'):
-        for grad, var in gradients:
-            if grad is not None:
-                yield tf.summary.histogram(var.op.name + '/gradients', grad)
+    for grad, var in gradients:
+        if grad is None:
+            continue
+        if name_filter is not None and not name_filter(var.op.name):
+            continue
+        if isinstance(grad, tf.IndexedSlices):
+            grad = grad.values
+        values = _downsample(grad, max_elements)
+        with tf.device('/cpu:0'):
+            yield tf.summary.histogram(var.op.name + '/gradients', values)
+
+
+class SummaryPolicy(object):
+    """Defines which histogram summaries the runtime creates for the variables and
+       gradients, and how often these are written. Histograms require to copy the
+       related tensors to the host, which can be more expensive than the training
+       step itself for large models.
+    """
+    def __init__(self, variables=True, gradients=True,
+                 collections=[tf.GraphKeys.TRAINABLE_VARIABLES],
+                 include=None, exclude=None, max_elements=None,
+                 histogram_steps=None, scalars_only=False):
+        """Creates a summary policy. The default policy creates full histograms of all
+           trainable variables and their gradients.
+        Parameters
+        ----------
+        variables: Boolean, optional
+            Whether to create histograms of the variables.
+        gradients: Boolean, optional
+            Whether to create histograms of the gradients.
+        collections: list(str), optional
+            The graph collections of the variables to create histograms for.
+        include: str or None, optional
+            A regular expression, that the variable name has to match (using re.search)
+            to create a variable or gradient histogram. Use None to include all.
+        exclude: str or None, optional
+            A regular expression to exclude the matching variable names.
+        max_elements: int or None, optional
+            The maximum number of elements of a tensor to use for its histogram. Larger
+            tensors are downsampled with a constant stride. Use None to use all values.
+        histogram_steps: int or None, optional
+            The default interval to write the histograms in training, in case it is not
+            defined explicitely. Use None to write them with all other summaries.
+        scalars_only: Boolean, optional
+            Whether only scalar summaries should be written, e.g. in production. This
+            ignores all other settings and drops all non-scalar summaries of the model.
+        """
+        assert max_elements is None or max_elements > 0, "Max elements has to be positive."
+        
+        self._variables = variables
+        self._gradients = gradients
+        self._collections = collections
+        self._include = re.compile(include) if include is not None else None
+        self._exclude = re.compile(exclude) if exclude is not None else None
+        self._max_elements = max_elements
+        self._histogram_steps = histogram_steps
+        self._scalars_only = scalars_only
+        
+    def _name_filter(self, name):
+        """Checks whether the variable name passes the include/exclude filters."""
+        name = _remove_tower_name(name)
+        if self._include is not None and self._include.search(name) is None:
+            return False
+        if self._exclude is not None and self._exclude.search(name) is not None:
+            return False
+        return True
     
-            
+    def histogram_summaries(self, gradients):
+        """Creates the histogram summaries of the variables and gradients.
+        Parameters
+        ----------
+        gradients: list[(gradient, variable)]
+            A list of (gradient, variable) pairs created by Optimizer.compute_gradients().
+        Returns
+        ----------
+        A list of string tensors that can ba added to a summary.
+        """
+        if self._scalars_only:
+            return []
+        
+        summaries = []
+        if self._gradients:
+            summaries.extend(gradients_histogram_summary(gradients, self._name_filter,
+                                                         self._max_elements))
+        if self._variables:
+            for collection in self._collections:
+                summaries.extend(variables_histogram_summary(collection, self._name_filter,
+                                                             self._max_elements))
+        return summaries
+    
+    def select(self, summaries):
+        """Selects the summaries to write according to this policy.
+        Parameters
+        ----------
+        summaries: list(Tensor)
+            The summary tensors.
+        Returns
+        ----------
+        The list of selected summary tensors.
+        """
+        if self._scalars_only:
+            return [s for s in summaries if s.op.type == 'ScalarSummary']
+        return summaries
+        
+    @property
+    def histogram_steps(self):
+        """Gets the default interval to write histograms, or None."""
+        return self._histogram_steps
+    
+    @property
+    def scalars_only(self):
+        """Gets whether only scalar summaries are written."""
+        return self._scalars_only
+
+
 def conv_image_summary(tag, conv_out, padding=1):
     """Creates an image summary of the convolutional outputs
        for the first image in the batch .
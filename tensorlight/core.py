@@ -2,8 +2,9 @@ from __future__ import print_function
 
 import os
 import time
+import shutil
+import tempfile
 import collections
-import copy
 from abc import ABCMeta, abstractmethod
 
 import numpy as np
@@ -59,12 +60,24 @@ class AbstractRuntime(object):
 
         self._feed_func = None
         self._model_feeds = None
+        self._x = None
+        self._y = None
+        self._compute_dtype = tf.float32
+        self._variable_averages = None
+        self._accumulate_steps = 1
+        self._accumulate_op = None
 
         self._saver = None
+        self._saver_var_list = None
+        self._max_checkpoints_to_keep = None
+        self._async_saver = None
         self._summary_writer = None
 
         self._train_op = None
         self._summaries = None
+        self._summary_op = None
+        self._histogram_summary_op = None
+        self._summary_policy = None
         
         self._total_loss = None
         self._loss = None
@@ -149,7 +162,8 @@ class AbstractRuntime(object):
     def build(self, is_autoencoder=False, input_shape=None, target_shape=None,
               max_checkpoints_to_keep=5, track_ema_variables=True, restore_checkpoint=None,
               restore_ema_variables=False, restore_model_params=False, restore_optimizer_params=False,
-              eval_mode=False, verbose=False):
+              eval_mode=False, summary_policy=None, recreate_via_checkpoint=False,
+              compute_dtype=tf.float32, loss_scale=None, accumulate_steps=1, verbose=False):
         """ Builds the model. This must be calles before training, validation, testing or prediction.
             This method can be called a second time to re-create a model. In case the dataset's  the
             input shape or target shape, or the explicit input/target-shape changes, it required a model
@@ -194,10 +208,32 @@ class AbstractRuntime(object):
             Flag that can be activated in evaluation mode in order to not restore EMA variables
             for all log-losses. These can lead the graph-construction to fail, even when these
             are not needed when doing predictions or evaluations.
+        summary_policy: light.board.SummaryPolicy or None, optional
+            The policy that defines which histogram summaries are created. Use None to
+            create full histograms of all trainable variables and their gradients.
+        recreate_via_checkpoint: Boolean, optional
+            Whether the variables are transferred through a temporary checkpoint file when
+            the model is re-created, instead of in memory. This requires less memory, because
+            not all variable values have to be held on the host at the same time.
+        compute_dtype: tf.DType, optional
+            The precision of the model inference. In case of tf.float16, the inputs and targets
+            are casted to half precision for the model, while all variables are stored in float32.
+            The inference is casted back to float32, so that losses and metrics are computed in
+            full precision.
+        loss_scale: float or str or None, optional
+            The loss scaling for mixed precision training, either a static scale, or
+            'light.training.DYNAMIC_LOSS_SCALE'. Use None to not scale the loss.
+        accumulate_steps: int, optional
+            The number of micro-batches whose gradients are accumulated before a single update
+            of the variables is applied. This trains with an effective batch size of
+            'accumulate_steps * batch_size' while only a single micro-batch has to fit into
+            the device memory. The global step, the learning rate decay and the EMA count the
+            applied updates only.
         verbose: Boolean, optional
             Set to True to show additional construction/variable information.
         """
         assert self._model is not None, "Register a model first."
+        assert accumulate_steps >= 1, "Accumulate steps must be >= 1."
         
         # restore model params
         if restore_model_params:
@@ -239,6 +275,8 @@ class AbstractRuntime(object):
             target_shape = reference_dataset.target_shape
                 
         recreate = False
+        transfer_values = None
+        tmp_dir = None
         if self._graph is not None:
             recreate = True
             # re-create model
@@ -248,10 +286,18 @@ class AbstractRuntime(object):
                 self._inferences = []
             
                 if restore_checkpoint is None:
-                    # use new saver to not modify 'max_to_keep' of global saver
-                    saver = tf.train.Saver()
-                    tmp_name = "/tmp/tmp-{}.ckpt".format(int(time.time()))
-                    saver.save(self.session, tmp_name)
+                    if recreate_via_checkpoint:
+                        # use new saver to not modify 'max_to_keep' of global saver
+                        saver = tf.train.Saver()
+                        tmp_dir = tempfile.mkdtemp(prefix="tmp-light-")
+                        tmp_name = os.path.join(tmp_dir, "tmp.ckpt")
+                        saver.save(self.session, tmp_name)
+                    else:
+                        # fetch all variable values at once, to transfer them in memory
+                        global_vars = tf.global_variables()
+                        values = self.session.run(global_vars)
+                        transfer_values = {var.op.name: value
+                                           for var, value in zip(global_vars, values)}
                 
                  # close session to ensure all resources are released
                 self.close()
@@ -262,16 +308,21 @@ class AbstractRuntime(object):
         with self.graph.as_default():
             # runtime placeholders and variables
             self._global_step = tf.get_variable('global_step', shape=[], dtype=tf.int32, trainable=False, initializer=tf.zeros_initializer())
-            self._ph.is_training = tf.placeholder(tf.bool, name='is_training')
-            self._ph.batch_size = tf.placeholder(tf.int32, name='batch_size')
-            self._ph.input_from_queue = tf.placeholder(tf.bool, name='input_from_queue')
+            self._ph.is_training = tf.placeholder_with_default(False, [], name='is_training')
+            self._ph.input_from_queue = tf.placeholder_with_default(False, [], name='input_from_queue')
             
             # input placeholders
             self._ph.inputs = tf.placeholder(tf.float32, [None] + input_shape, "X")
+            self._ph.batch_size = tf.placeholder_with_default(tf.shape(self._ph.inputs)[0], [],
+                                                              name='batch_size')
+            
+            # the targets do not have to be fed for inference, which depends on the inputs only
             if is_autoencoder:
-                self._ph.targets = tf.placeholder(tf.float32, [None] + input_shape, "Y")
+                self._ph.targets = tf.placeholder_with_default(self._ph.inputs, [None] + input_shape, "Y")
             else:
-                self._ph.targets = tf.placeholder(tf.float32, [None] + target_shape, "Y")
+                with tf.name_scope("default_targets"):
+                    default_targets = tf.zeros(tf.stack([tf.shape(self._ph.inputs)[0]] + target_shape))
+                self._ph.targets = tf.placeholder_with_default(default_targets, [None] + target_shape, "Y")
 
             if is_queue_dataset:
                 with tf.device("/cpu:0"):
@@ -289,35 +340,54 @@ class AbstractRuntime(object):
                 x = tf.cond(self._ph.input_from_queue, lambda: inputs, lambda: self._ph.inputs)
                 y = tf.cond(self._ph.input_from_queue, lambda: targets, lambda: self._ph.targets)
 
-                if is_autoencoder:
-                    self._feed_func = lambda inputs, targets, bs, is_train: {self._ph.inputs: inputs,
-                                                                             self._ph.targets: inputs,
-                                                                             self._ph.batch_size: bs,
-                                                                             self._ph.is_training: is_train}
-                else:
-                    self._feed_func = lambda inputs, targets, bs, is_train : {self._ph.inputs: inputs,
-                                                                              self._ph.targets: targets,
-                                                                              self._ph.batch_size: bs,
-                                                                              self._ph.is_training: is_train}
+                def feed_func(inputs, targets, bs, is_train):
+                    """Creates the feed dict. The targets can be None for inference,
+                       and are never fed for autoencoders."""
+                    feed = {self._ph.inputs: inputs,
+                            self._ph.batch_size: bs,
+                            self._ph.is_training: is_train}
+                    if targets is not None and not is_autoencoder:
+                        feed[self._ph.targets] = targets
+                    return feed
+                self._feed_func = feed_func
                 self._model_feeds = self._model.fetch_feeds();
             
             # build the optimizer instance
+            self._compute_dtype = tf.as_dtype(compute_dtype)
             with tf.name_scope('optimizer'):
-                opt, lr = self.optimizer.build(self._global_step)
+                opt, lr = self.optimizer.build(self._global_step, loss_scale=loss_scale)
               
             # install the model and make global variables availalbe
             self._model.install(self._global_step)
             
+            # keep the selected inputs/targets, to be able to bypass the input queue on export
+            self._x = x
+            self._y = y
+            
             # build (multi-)device specific computation graph for inference
             grads, summaries, total_loss, loss, eval_dict = self._build_computation_graph(x, y, opt, eval_mode)
             
-            # Apply gradients
-            apply_gradient_op = opt.apply_gradients(grads, global_step=self._global_step)
+            # Apply gradients, optionally averaged over multiple micro-batches
+            self._accumulate_steps = accumulate_steps
+            if accumulate_steps > 1:
+                accumulate_op, mean_grads, accumulators = light.training.accumulate_gradients(grads,
+                                                                                              accumulate_steps)
+                apply_gradient_op = opt.apply_gradients(mean_grads, global_step=self._global_step)
+                # reset the buffers for the next update
+                with tf.control_dependencies([apply_gradient_op]):
+                    apply_gradient_op = tf.group(*[tf.assign(acc, tf.zeros_like(acc))
+                                                   for acc in accumulators])
+                self._accumulate_op = accumulate_op
+            else:
+                apply_gradient_op = opt.apply_gradients(grads, global_step=self._global_step)
+                self._accumulate_op = None
 
             # Add summaries
+            if summary_policy is None:
+                summary_policy = light.board.SummaryPolicy()
             summaries.append(tf.summary.scalar('learning_rate', lr))
-            summaries.extend(light.board.gradients_histogram_summary(grads))
-            summaries.extend(light.board.variables_histogram_summary())
+            summaries.extend(summary_policy.histogram_summaries(grads))
+            summaries = summary_policy.select(summaries)
 
             # Track the moving averages of all trainable variables
             variable_averages = tf.train.ExponentialMovingAverage(0.9999, self._global_step)
@@ -325,9 +395,11 @@ class AbstractRuntime(object):
             if track_ema_variables:
                 variables_averages_op = variable_averages.apply(tf.trainable_variables())
                 train_op = tf.group(apply_gradient_op, variables_averages_op, name="train_op")
+                self._variable_averages = variable_averages
             else:
                 # exclude the 
                 train_op = tf.group(apply_gradient_op, name="train_op")
+                self._variable_averages = None
             
             # fetch update ops, that is required e.g. for tf.contrib.layers.batch_norm
             update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
@@ -339,6 +411,16 @@ class AbstractRuntime(object):
 
             self._train_op = train_op
             self._summaries = summaries
+            self._summary_policy = summary_policy
+            
+            # merge the summaries once, but separate the expensive histograms
+            # to be able to write these less frequently
+            histogram_summaries = [s for s in summaries if s.op.type == 'HistogramSummary']
+            other_summaries = [s for s in summaries if s.op.type != 'HistogramSummary']
+            self._summary_op = tf.summary.merge(other_summaries) \
+                if len(other_summaries) > 0 else None
+            self._histogram_summary_op = tf.summary.merge(histogram_summaries) \
+                if len(histogram_summaries) > 0 else None
             self._total_loss = total_loss
             self._loss = loss
             self._eval_dict = eval_dict
@@ -351,6 +433,8 @@ class AbstractRuntime(object):
             
             self._saver = tf.train.Saver(var_list=restore_vars,
                                          max_to_keep=max_checkpoints_to_keep)
+            self._saver_var_list = restore_vars
+            self._max_checkpoints_to_keep = max_checkpoints_to_keep
             
             def perform_restore(saver, filepath, restore_ema):
                 """Restores a checkpoint, either the raw variables or the EMA values."""
@@ -369,11 +453,39 @@ class AbstractRuntime(object):
                     print("Restoring variables...")
                     saver.restore(self.session, filepath)
                 return saver
+            
+            def perform_restore_from_values(values, restore_ema):
+                """Restores the variables from values in memory, by feeding these into
+                   the initializers. Uses the same name mapping as the checkpoint restore."""
+                if isinstance(restore_vars, dict):
+                    var_dict = restore_vars
+                else:
+                    var_dict = {var.op.name: var for var in restore_vars}
+                
+                missing_names = [name for name in var_dict if name not in values]
+                feed = {}
+                if len(missing_names) > 0:
+                    if not restore_ema:
+                        raise tf.errors.NotFoundError(None, None,
+                                                      "Variables not found: {}".format(missing_names))
+                    print("Warning: Could not restore model, because no EMA variables have been found.",\
+                          "Use 'restore_ema_variables=False' instead.")
+                else:
+                    for name, var in var_dict.iteritems():
+                        feed[var.initial_value] = values[name]
+                
+                print("Restoring EMA variables..." if restore_ema else "Restoring variables...")
+                self.session.run([tf.global_variables_initializer(),
+                                  tf.local_variables_initializer()], feed_dict=feed)
 
             if restore_checkpoint is None:
                 if recreate:
-                    saver = tf.train.Saver(var_list=restore_vars)
-                    perform_restore(saver, tmp_name, restore_ema_variables)
+                    if transfer_values is not None:
+                        perform_restore_from_values(transfer_values, restore_ema_variables)
+                    else:
+                        saver = tf.train.Saver(var_list=restore_vars)
+                        perform_restore(saver, tmp_name, restore_ema_variables)
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
                 else:
                     # start session and init all variables
                     print("Initializing variables...")
@@ -390,6 +502,15 @@ class AbstractRuntime(object):
                     
                 print("Selected checkpoint file: {}".format(checkpoint_path))
                 perform_restore(self._saver, checkpoint_path, restore_ema_variables)
+            
+            # local variables, such as the gradient accumulators or the dynamic loss scale,
+            # are not part of any checkpoint
+            uninitialized_names = set(self.session.run(
+                tf.report_uninitialized_variables(tf.local_variables())))
+            uninitialized_vars = [var for var in tf.local_variables()
+                                  if var.op.name in uninitialized_names]
+            if len(uninitialized_vars) > 0:
+                self.session.run(tf.variables_initializer(uninitialized_vars))
 
             # creates coordinatior and queue threads
             self._coord = tf.train.Coordinator()
@@ -400,6 +521,34 @@ class AbstractRuntime(object):
             print()
             light.core.show_trainable_parameters(verbose)
             
+    def _model_inference(self, x, y, device_scope):
+        """Builds the model inference in the compute precision. The returned inference
+           is always float32, to compute the losses and metrics in full precision.
+        Parameters
+        ----------
+        x: n-D Tensor
+            The inputs tensor.
+        y: m-D Tensor
+            The targets tensor.
+        device_scope: str or None
+            The tower name in case of multi-GPU runs.
+        Returns
+        ----------
+        The float32 inference tensor.
+        """
+        if self._compute_dtype != tf.float32:
+            x = tf.cast(x, self._compute_dtype)
+            y = tf.cast(y, self._compute_dtype)
+        
+        inference = self._model.inference(x, y,
+                                          feeds=self._model_feeds,
+                                          is_training=self._ph.is_training,
+                                          device_scope=device_scope, memory_device=None)
+        
+        if inference.dtype.base_dtype != tf.float32:
+            inference = tf.cast(inference, tf.float32)
+        return inference
+    
     @abstractmethod
     def _build_computation_graph(self, x, y, opt):
         """Builds the (device or runtime specific) computation graph.
@@ -418,22 +567,25 @@ class AbstractRuntime(object):
         pass
         
     def train(self, batch_size, valid_batch_size=None, steps=-1, epochs=-1, train_feeds={}, valid_feeds={},
-              on_validate=None, display_steps=25, summary_steps=100, checkpoint_steps=1000,
-              validation_steps=1000, extra_validations=[100, 250, 500, 750],
-              do_checkpoints=True, do_summary=True, save_model_params=True, save_optimizer_params=True):
+              on_validate=None, display_steps=25, summary_steps=100, histogram_steps=None,
+              checkpoint_steps=1000, validation_steps=1000, extra_validations=[100, 250, 500, 750],
+              do_checkpoints=True, do_summary=True, save_model_params=True, save_optimizer_params=True,
+              async_checkpoints=False, prefetch_batches=0, prefetch_workers=1, prefetch_mode=light.inputs.PREFETCH_THREAD):
         """Train the model.
            Note that either 'steps' or 'epochs' has to be defined as a param.
         Parameters
         ----------
         batch_size: int
             The batch size to use for training (and for validation, in case
-            'valid_batch_size') is not defined.
+            'valid_batch_size') is not defined. In case gradients are accumulated,
+            this is the size of a single micro-batch.
         valid_batch_size: int or None, optional
             The batch size to use for validation, or None to use the same as for training.
             You might want to use a different batch_size for validation, to make sure that
             every example is actually evaluated.
         steps: int, partly-required
-            The number of steps to train the model.
+            The number of steps to train the model. In case gradients are accumulated,
+            each step processes 'accumulate_steps' micro-batches, as defined in build().
         epochs: int, partly-required
             The number of epochs to train the model.
         train_feeds: dict(str, tf.placeholder), optional
@@ -450,6 +602,11 @@ class AbstractRuntime(object):
             shoud be performed. Required for logging/testing only.
         summary_steps: int, optional
             In which interval we write a summary to TensorBoard.
+        histogram_steps: int or None, optional
+            In which interval we write the histogram summaries to TensorBoard, which are
+            much more expensive than scalar summaries. Use None to take the interval of the
+            summary policy, which defaults to write them together with all other summaries
+            every 'summary_steps'. Use 0 to not write them at all.
         checkpoint_steps: int, optional
             In which interval we create a checkpoint.
         validation_steps: int, optional
@@ -472,6 +629,19 @@ class AbstractRuntime(object):
         save_optimizer_params: Boolean, optional
             Whether to save the optimizer params in the training directory or not.
             This will override an existing file in case of re-training.
+        async_checkpoints: Boolean, optional
+            Whether the checkpoints are written in a background thread. The variables are
+            snapshotted to host memory, and the training only waits in case the previous
+            checkpoint is still being written.
+        prefetch_batches: int, optional
+            The number of training batches that are generated in the background ahead of
+            the training loop. Use 0 (default) to generate the batches synchronously.
+            Ignored for queue datasets.
+        prefetch_workers: int, optional
+            The number of workers that generate the prefetched batches.
+        prefetch_mode: str, optional
+            Whether the workers are threads (light.inputs.PREFETCH_THREAD) or
+            processes (light.inputs.PREFETCH_PROCESS).
         """
         assert not(steps <= 0 and epochs <= 0), "Either set 'steps' or 'epochs' parameter"
         assert not(steps > 0 and epochs > 0), "Not allowed to set both, 'steps' and 'epochs' parameter"
@@ -494,18 +664,34 @@ class AbstractRuntime(object):
         if valid_batch_size is None:
             # take training batch_size as fallback.
             valid_batch_size = batch_size
+        
+        if histogram_steps is None:
+            histogram_steps = self._summary_policy.histogram_steps
+        if histogram_steps is None:
+            histogram_steps = summary_steps
             
-        batches_per_epoch = dataset.size // batch_size
+        # each step applies the accumulated gradients of multiple micro-batches
+        effective_batch_size = batch_size * self._accumulate_steps
+        batches_per_epoch = dataset.size // effective_batch_size
+        assert batches_per_epoch > 0, "Dataset is smaller than the (effective) batch-size."
 
         if epochs > 0:
             steps = batches_per_epoch * epochs
 
         dataset.reset()
         
+        prefetcher = None
+        if prefetch_batches > 0 and not isinstance(dataset, light.datasets.base.AbstractQueueDataset):
+            prefetcher = light.inputs.BatchPrefetcher(dataset, batch_size, prefetch_batches,
+                                                      prefetch_workers, prefetch_mode)
+            prefetcher.start()
+        
         with self.graph.as_default():
             # take the CPU as root device in case of many GPUs
             device_scope = None if self.num_computing_devices == 1 else '/cpu:0'
             with tf.device(device_scope):
+                # to not hide an error of the training by an error of the last checkpoint write
+                completed = False
                 try:
                     this_step = 0
                     step_divisor = 0
@@ -513,12 +699,28 @@ class AbstractRuntime(object):
                     loss_sum = 0
 
                     x_dummy = np.zeros([batch_size] + dataset.input_shape, np.float32)
-                    y_dummy = np.zeros([batch_size] + dataset.target_shape, np.float32)
-
-                    # add batch-size to summary. Copy is required to allow rerun training
-                    summaries_copy = copy.copy(self._summaries)
-                    summaries_copy.append(tf.summary.scalar('batch_size', batch_size))
-                    summary_op = tf.summary.merge(summaries_copy)
+                    
+                    # add batch-size to summary, without creating a summary op
+                    batch_size_summary = tf.Summary(value=[tf.Summary.Value(tag='batch_size',
+                                                                            simple_value=effective_batch_size)])
+                    
+                    def next_feed():
+                        """Prepares the feeding of the next (micro-)batch."""
+                        if isinstance(dataset, light.datasets.base.AbstractQueueDataset):
+                            batch_x = x_dummy
+                            batch_y = None
+                        elif prefetcher is not None:
+                            batch_x, batch_y = prefetcher.get_batch()
+                        else:
+                            batch_x, batch_y = dataset.get_batch(batch_size)
+                        feed = self._feed_func(batch_x, batch_y, batch_size, True)
+                        feed.update({self._ph.input_from_queue: True \
+                                     if isinstance(dataset, light.datasets.base.AbstractQueueDataset) else False})
+                        for key, value in train_feeds.iteritems():
+                            feed.update({self._model_feeds[key]: value})
+                        return feed
+                    
+                    gstep = self.gstep
 
                     while not self._coord.should_stop():
                         this_step += 1
@@ -531,28 +733,46 @@ class AbstractRuntime(object):
 
                         start_time = time.time()
 
-                        # prepare feeding
-                        if isinstance(dataset, light.datasets.base.AbstractQueueDataset):
-                            batch_x = x_dummy
-                            batch_y = y_dummy
-                        else:
-                            batch_x, batch_y = dataset.get_batch(batch_size)
-                        feed = self._feed_func(batch_x, batch_y, batch_size, True)
-                        feed.update({self._ph.input_from_queue: True \
-                                     if isinstance(dataset, light.datasets.base.AbstractQueueDataset) else False})
-                        for key, value in train_feeds.iteritems():
-                            feed.update({self._model_feeds[key]: value})
-
                         if this_step == 1 and isinstance(dataset, light.datasets.base.AbstractQueueDataset):
                             print("Filling queue with {} examples...".format(dataset.min_examples_in_queue))
 
+                        # accumulate the gradients of all but the last micro-batch, which
+                        # are applied together with the last one by the train-op
+                        micro_total_loss_sum = 0
+                        micro_loss_sum = 0
+                        for _ in xrange(self._accumulate_steps - 1):
+                            _, total_loss, loss = self.session.run([self._accumulate_op,
+                                                                    self._total_loss,
+                                                                    self._loss],
+                                                                   feed_dict=next_feed())
+                            micro_total_loss_sum += total_loss
+                            micro_loss_sum += loss
+
+                        # fetch the summaries within the training step on summary steps, to
+                        # evaluate these on the same batch without an additional forward pass
+                        next_gstep = gstep + 1
+                        summary_ops = []
+                        if do_summary:
+                            if self._summary_op is not None and \
+                               (next_gstep % summary_steps == 0 or this_step == steps):
+                                summary_ops.append(self._summary_op)
+                            if self._histogram_summary_op is not None and histogram_steps > 0 and \
+                               (next_gstep % histogram_steps == 0 or this_step == steps):
+                                summary_ops.append(self._histogram_summary_op)
+
                         # step counter is increment when train_op is executed
-                        _, gstep, total_loss, loss = self.session.run([self._train_op,
-                                                                      self._global_step,
-                                                                      self._total_loss,
-                                                                      self._loss],
-                                                                     feed_dict=feed)
+                        results = self.session.run([self._train_op,
+                                                    self._global_step,
+                                                    self._total_loss,
+                                                    self._loss] + summary_ops,
+                                                   feed_dict=next_feed())
+                        _, gstep, total_loss, loss = results[:4]
+                        summary_strings = results[4:]
                         duration = time.time() - start_time
+                        
+                        if self._accumulate_steps > 1:
+                            total_loss = (micro_total_loss_sum + total_loss) / self._accumulate_steps
+                            loss = (micro_loss_sum + loss) / self._accumulate_steps
 
                         assert not np.isnan(loss), 'Warning: Model diverged with loss = NaN'
 
@@ -561,7 +781,7 @@ class AbstractRuntime(object):
                         loss_sum += loss
                         if this_step == 1 or gstep % display_steps == 0:
                             # info
-                            num_examples_per_step = batch_size
+                            num_examples_per_step = effective_batch_size
                             examples_per_sec = num_examples_per_step / duration
                             sec_per_batch = float(duration)
                             avg_total_loss = total_loss_sum / step_divisor
@@ -574,12 +794,12 @@ class AbstractRuntime(object):
                                   .format(gstep, avg_loss, avg_total_loss,
                                           examples_per_sec, sec_per_batch))
 
-                        if gstep % summary_steps == 0 or this_step == steps:
+                        if len(summary_strings) > 0:
                             # summary
-                            if do_summary == True:
-                                summary_str = self.session.run(summary_op, feed_dict=feed)
+                            for summary_str in summary_strings:
                                 self.summary_writer.add_summary(summary_str, gstep)
-                                self.summary_writer.flush() 
+                            self.summary_writer.add_summary(batch_size_summary, gstep)
+                            self.summary_writer.flush() 
 
                         if gstep in extra_validations or this_step == steps or \
                             epochs == -1 and gstep % validation_steps == 0 or \
@@ -599,11 +819,32 @@ class AbstractRuntime(object):
                                 epochs > 0 and this_step % batches_per_epoch == 0:
                                 # save regular checkpoint
                                 checkpoint_path = os.path.join(self.train_dir, CHECKPOINT_FILE)
-                                self._saver.save(self.session, checkpoint_path,
-                                                 global_step=self._global_step)
+                                if async_checkpoints:
+                                    if self._async_saver is None:
+                                        self._async_saver = light.training.AsyncCheckpointSaver(
+                                            self._saver_var_list, self._max_checkpoints_to_keep)
+                                    self._async_saver.save(self.session, checkpoint_path, gstep)
+                                else:
+                                    # continue the checkpoint history of previous runs or async saves
+                                    light.training.recover_checkpoint_history(self._saver, self.train_dir)
+                                    self._saver.save(self.session, checkpoint_path,
+                                                     global_step=self._global_step)
+                    completed = True
 
                 except tf.errors.OutOfRangeError:
                     print("Interrupted: Queue runners are out of range. Epoch limit reached?")
+                    completed = True
+                finally:
+                    if prefetcher is not None:
+                        prefetcher.stop()
+                    if self._async_saver is not None:
+                        # ensure the last checkpoint is completely written
+                        try:
+                            self._async_saver.wait()
+                        except Exception as e:
+                            if completed:
+                                raise
+                            print("Warning: Writing the last checkpoint failed: {}".format(e))
     
     def predict(self, inputs, feeds={}):
         """Performs a prediction using the trained model.
@@ -619,17 +860,190 @@ class AbstractRuntime(object):
         The predictions of the model as an numpy n-D array.
         """
         with self.graph.as_default():
-            batch_size = inputs.shape[0]
+            # pad the batch to be splittable across all computing devices
+            count = inputs.shape[0]
+            batch_size = count + (-count) % self.num_computing_devices
+            return self._predict_chunk(inputs, batch_size, feeds)
+        
+    def predict_batched(self, inputs, batch_size, feeds={}):
+        """Performs a prediction using the trained model, by splitting the inputs into
+           chunks of the given batch size. This allows to predict large input arrays
+           without running out of memory.
+        Parameters
+        ----------
+        inputs: numpy n-D array
+            The inputs to the model to do the inference.
+        batch_size: int
+            The batch size of each chunk, which has to be a multiple of the computing devices.
+            The last partial chunk is padded to this size.
+        feeds: dict(str, tf.placeholder), optional
+            The model specific feeds, that have been
+            defined in AbstractModel.fetch_feeds().
+        Returns
+        ---------
+        The predictions of the model as an numpy n-D array.
+        """
+        assert batch_size % self.num_computing_devices == 0, \
+            "Batch-size has to be a multiple of computing devices used."
+        
+        with self.graph.as_default():
+            count = inputs.shape[0]
+            predictions = None
+            for start in xrange(0, count, batch_size):
+                chunk = self._predict_chunk(inputs[start:(start + batch_size)], batch_size, feeds)
+                if predictions is None:
+                    predictions = np.empty([count] + list(chunk.shape[1:]), dtype=chunk.dtype)
+                predictions[start:(start + chunk.shape[0])] = chunk
+            return predictions
+        
+    def predict_iter(self, inputs_iter, batch_size, feeds={}):
+        """Performs predictions of a stream of single examples using the trained model,
+           which are internally grouped to batches. The predictions are yielded as soon as
+           the batch is processed.
+        Parameters
+        ----------
+        inputs_iter: iterable of numpy n-D arrays
+            An iterable, such as a generator, of single inputs (without batch dimension).
+        batch_size: int
+            The batch size to group the inputs, which has to be a multiple of the computing
+            devices. The last partial batch is padded to this size.
+        feeds: dict(str, tf.placeholder), optional
+            The model specific feeds, that have been
+            defined in AbstractModel.fetch_feeds().
+        Returns
+        ---------
+        A generator of the single predictions of the model, in the order of the inputs.
+        """
+        assert batch_size % self.num_computing_devices == 0, \
+            "Batch-size has to be a multiple of computing devices used."
+        
+        batch = []
+        for inputs in inputs_iter:
+            batch.append(inputs)
+            if len(batch) == batch_size:
+                with self.graph.as_default():
+                    predictions = self._predict_chunk(np.stack(batch), batch_size, feeds)
+                batch = []
+                for prediction in predictions:
+                    yield prediction
+        
+        if len(batch) > 0:
+            with self.graph.as_default():
+                predictions = self._predict_chunk(np.stack(batch), batch_size, feeds)
+            for prediction in predictions:
+                yield prediction
+    
+    def _predict_chunk(self, inputs, batch_size, feeds):
+        """Performs the prediction of a single chunk, which is split across all towers.
+        Parameters
+        ----------
+        inputs: numpy n-D array
+            The inputs of the chunk with at most 'batch_size' examples.
+        batch_size: int
+            The batch size the inputs are padded to, which has to be a multiple of
+            the computing devices.
+        feeds: dict(str, tf.placeholder)
+            The model specific feeds.
+        Returns
+        ---------
+        The predictions of the unpadded inputs as an numpy n-D array.
+        """
+        count = inputs.shape[0]
+        if count < batch_size:
+            padding = np.zeros([batch_size - count] + list(inputs.shape[1:]), dtype=inputs.dtype)
+            inputs = np.concatenate((inputs, padding))
+        
+        # prepare feeding, without any targets
+        feed = self._feed_func(inputs, None, batch_size, False)
+        feed.update({self._ph.input_from_queue: False})
+        for key, value in feeds.iteritems():
+            feed.update({self._model_feeds[key]: value})
+        
+        # each tower infers its own part of the batch
+        tower_predictions = self.session.run(self._inferences, feed_dict=feed)
+        if len(tower_predictions) == 1:
+            predictions = tower_predictions[0]
+        else:
+            predictions = np.concatenate(tower_predictions)
+        return predictions[:count]
+        
+    def export_inference(self, path, use_ema=True):
+        """Exports a frozen inference graph, where all variables are folded into constants
+           and everything that is not required to compute the inference of the first device
+           is pruned, such as the input queue, the optimizer, the losses and the summaries.
+           The exported graph can be loaded using 'light.serving.FrozenInference'.
+        Parameters
+        ----------
+        path: str
+            The file path of the binary GraphDef. The signature, which describes the input
+            and output tensors, is written next to it with the postfix '.signature.json'.
+        use_ema: Boolean, optional
+            Whether the exponential moving averages of the trainable variables should be exported
+            instead of their raw values. Requires that the EMA variables have been tracked.
+        Returns
+        ----------
+        The frozen GraphDef.
+        """
+        assert len(self._inferences) > 0, "Build the model first."
+        assert self.num_computing_devices == 1, \
+            "Export requires a single-device runtime, because each tower only infers a part of the batch."
+        
+        def tensor_ref(tensor):
+            """Gets the reference of a tensor as used in the GraphDef node inputs."""
+            return tensor.op.name if tensor.value_index == 0 else tensor.name
+        
+        with self.graph.as_default():
+            output_name = self._inferences[0].op.name
             
-            # prepare feeding
-            y_dummy = np.zeros([batch_size] + self._ph.targets.get_shape().as_list()[1:], np.float32)
-            feed = self._feed_func(inputs, y_dummy, batch_size, False)
-            feed.update({self._ph.input_from_queue: False})
-            for key, value in feeds.iteritems():
-                feed.update({self._model_feeds[key]: value})
+            # bypass the queue selection, to only depend on the placeholders
+            rewire = {tensor_ref(self._x): tensor_ref(self._ph.inputs),
+                      tensor_ref(self._y): tensor_ref(self._ph.targets)}
+            graph_def = self.graph.as_graph_def()
+            for node in graph_def.node:
+                for i, node_input in enumerate(node.input):
+                    if node_input in rewire:
+                        node.input[i] = rewire[node_input]
+            
+            frozen_graph_def = tf.graph_util.convert_variables_to_constants(self.session, graph_def,
+                                                                            [output_name])
             
-            return self.session.run(self._inferences[0], feed_dict=feed)
+            if use_ema:
+                if self._variable_averages is None:
+                    print("Warning: No EMA variables have been tracked. Exporting raw variables instead.")
+                else:
+                    ema_vars = {}
+                    for var in tf.trainable_variables():
+                        average = self._variable_averages.average(var)
+                        if average is not None:
+                            ema_vars[var.op.name] = average
+                    ema_values = dict(zip(ema_vars.keys(), self.session.run(ema_vars.values())))
+                    
+                    for node in frozen_graph_def.node:
+                        if node.op == 'Const' and node.name in ema_values:
+                            value = ema_values[node.name]
+                            node.attr["value"].CopyFrom(
+                                tf.AttrValue(tensor=tf.make_tensor_proto(value, shape=value.shape)))
         
+        dirpath = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        with open(path, 'wb') as f:
+            f.write(frozen_graph_def.SerializeToString())
+        
+        # map the model feeds that are still contained in the pruned graph
+        used_nodes = set([node.name for node in frozen_graph_def.node])
+        feeds = {key: feed.name for key, feed in self._model_feeds.iteritems()
+                 if feed.op.name in used_nodes} if self._model_feeds is not None else {}
+        light.serving.write_signature(path,
+                                      inputs=self._ph.inputs.name,
+                                      output=self._inferences[0].name,
+                                      is_training=self._ph.is_training.name \
+                                          if self._ph.is_training.op.name in used_nodes else None,
+                                      feeds=feeds)
+        print("Exported frozen inference graph with {} nodes to: {}".format(
+            len(frozen_graph_def.node), path))
+        return frozen_graph_def
+
     def validate(self, batch_size, feeds={}):
         """Performs a validation on the trained model using the validation
            dataset that was registered to the runtime.
@@ -699,15 +1113,14 @@ class AbstractRuntime(object):
               .format(gstep, title, batch_size, dataset.size))
         
         dataset.reset()
-        eval_sums = np.zeros(len(eval_ops))
+        eval_sums = [0.0] * len(eval_ops)
         x_dummy = np.zeros([batch_size] + dataset.input_shape, np.float32)
-        y_dummy = np.zeros([batch_size] + dataset.target_shape, np.float32)
         progress = light.utils.ui.ProgressBar(num_batches * batch_size)
         for b in xrange(num_batches):
             # prepare feeding
             if isinstance(dataset, light.datasets.base.AbstractQueueDataset):
                 batch_x = x_dummy
-                batch_y = y_dummy
+                batch_y = None
             else:
                 batch_x, batch_y = dataset.get_batch(batch_size)
             feed = self._feed_func(batch_x, batch_y, batch_size, False)
@@ -717,29 +1130,23 @@ class AbstractRuntime(object):
                 feed.update({self._model_feeds[key]: value})
 
             # run evaluation for all ops
-            this_evals_tuple = self.session.run(eval_ops, feed_dict=feed)
-            this_evals = np.array(this_evals_tuple)
-            eval_sums += this_evals
+            this_evals = self.session.run(eval_ops, feed_dict=feed)
             
             # create status list for progress bar
             status_list = []
             for i, name in enumerate(eval_names):
+                eval_sums[i] += float(this_evals[i])
                 status_list.append((name, this_evals[i]))
             
             progress.update((b+1) * batch_size, status_list)
             
         if do_summary:
-            avg_evals = eval_sums / num_batches
-            
-            # execute all summaries in a single run
-            eval_summaries = []
-            for i, name in enumerate(eval_names):
-                eval_summaries.append(tf.summary.scalar("{}_{}".format(title, name), avg_evals[i]))
-            summary_strings = self.session.run(eval_summaries)
-            
-            # add to summary writer
-            for sum_str in summary_strings:
-                self.summary_writer.add_summary(sum_str, gstep)
+            # write the averages as summary protobuf directly, which does
+            # not add any summary ops to the graph
+            summary = tf.Summary(value=[tf.Summary.Value(tag="{}_{}".format(title, name),
+                                                         simple_value=eval_sums[i] / num_batches)
+                                        for i, name in enumerate(eval_names)])
+            self.summary_writer.add_summary(summary, gstep)
             self.summary_writer.flush()
             
     def _check_dataset_registered(self, dataset):
@@ -758,6 +1165,10 @@ class AbstractRuntime(object):
         
     def close(self):
         """Closes the runtime and releases the all threads."""
+        if self._async_saver is not None:
+            self._async_saver.close()
+            self._async_saver = None
+        
         if self._coord is not None:
             self._coord.request_stop()
         
@@ -885,10 +1296,7 @@ class DefaultRuntime(AbstractRuntime):
         # Build inference Graph.This function constructs 
         # the entire model but shares the variables across all towers.
         with tf.name_scope("inference"):
-            inference = self._model.inference(x, y,
-                                              feeds=self._model_feeds,
-                                              is_training=self._ph.is_training,
-                                              device_scope=None, memory_device=None)
+            inference = self._model_inference(x, y, device_scope=None)
             
             # ensure the inference shape is fully defined and equal to target shape
             inference = tf.reshape(inference, [-1] + y.get_shape().as_list()[1:],
@@ -973,11 +1381,8 @@ class MultiGpuRuntime(AbstractRuntime):
                     # Build inference Graph.This function constructs 
                     # the entire model but shares the variables across all towers.
                     with tf.name_scope("inference"):
-                        inference = self._model.inference(this_inputs, this_targets,
-                                                          feeds=self._model_feeds,
-                                                          is_training=self._ph.is_training,
-                                                          device_scope=scope,
-                                                          memory_device=None) # '/cpu:0'
+                        inference = self._model_inference(this_inputs, this_targets,
+                                                          device_scope=scope)
                         # FIXME: inference(..., memory_device=...) should be set to '/cpu:0' according to
                         #        the TensorFlow CIFAR-10 example. But this causes init-errors on the LSMT-cells.
                         #        Doing no assignment to CPU-memory works. It might require more memory, but the
@@ -1041,30 +1446,8 @@ class MultiGpuRuntime(AbstractRuntime):
             avg_eval_dict.update({key: avg_scalar_ops})
             
         return grads, summaries, avg_total_loss, avg_loss, avg_eval_dict
-        
-    @light.utils.attr.override
-    def predict(self, inputs, feeds={}):
-        """Performs a prediction using the trained model.
-        Parameters
-        ----------
-        inputs: numpy n-D array
-            The inputs to the model to do the inference.
-        feeds: dict(str, tf.placeholder), optional
-            The model specific feeds, that have been
-            defined in AbstractModel.fetch_feeds().
-        Returns
-        ---------
-        The predictions of the model as an numpy n-D array.
-        """
-        # Workaround: Let each tower do the same stuff, but only use the result of the
-        #             first tower. Required to support e.g. batch-size 1 or odd batches.
-        inputs_concat = inputs
-        for i in xrange(self.num_computing_devices - 1):
-            inputs_concat = np.concatenate((inputs_concat, inputs))
-        
-        return super(MultiGpuRuntime, self).predict(inputs_concat, feeds)
 
-    
+
 def show_trainable_parameters(verbose=False):
     """Shows the number of trainable parameters in this graph.
     Parameters
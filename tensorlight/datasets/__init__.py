@@ -1,6 +1,9 @@
 import base
-import mnist
-import moving_mnist
-import ms_pacman
-import ucf11
-import ucf101
\ No newline at end of file
+
+# modules with heavy dependencies are imported on first access
+from tensorlight.utils.lazy import LazyModule
+mnist = LazyModule(__name__ + ".mnist")
+moving_mnist = LazyModule(__name__ + ".moving_mnist")
+ms_pacman = LazyModule(__name__ + ".ms_pacman")
+ucf11 = LazyModule(__name__ + ".ucf11")
+ucf101 = LazyModule(__name__ + ".ucf101")
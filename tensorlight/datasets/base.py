@@ -75,6 +75,12 @@ class AbstractDataset(object):
     def target_shape(self):
         """Gets the target shape."""
         return self._target_shape
+    
+    @property
+    def volatile_batches(self):
+        """Indicates whether the returned batches are only valid until the next call
+           of get_batch(), e.g. because they are views into recycled buffers."""
+        return False
 
 
     
@@ -1,5 +1,9 @@
 import sys
+import ctypes
+import traceback
+import multiprocessing
 from abc import ABCMeta
+from six.moves import queue
 
 import h5py
 import numpy as np
@@ -77,6 +81,21 @@ class MovingMNISTBaseGeneratedDataset(base.AbstractDataset):
     
     @light.utils.attr.override
     def get_batch(self, batch_size):
+        return self._split_sequences(self._generate_sequences(batch_size))
+    
+    def _generate_sequences(self, batch_size, out=None):
+        """Generates a batch of full-length sequences, including inputs and targets.
+        Parameters
+        ----------
+        batch_size: int
+            The batch size.
+        out: ndarray(float32) of shape [batch_size, t_input + t_target, h, w, c] or None, optional
+            The array to write the sequences into, which will be overridden. Or None
+            to allocate a new one.
+        Returns
+        ----------
+        The generated sequences of shape [batch_size, t_input + t_target, h, w, c].
+        """
         input_seq_length = self.input_shape[0]
         target_seq_length = self.target_shape[0]
         total_seq_length = input_seq_length + target_seq_length
@@ -85,44 +104,80 @@ class MovingMNISTBaseGeneratedDataset(base.AbstractDataset):
                                                                                   self.input_shape[1:],
                                                                                   self._digit_size,
                                                                                   self._step_length)
+        # trajectories of shape [t, batch_size * num_digits] to [batch_size, num_digits, t]
+        start_y = start_y.T.reshape(batch_size, self._num_digits, total_seq_length)
+        start_x = start_x.T.reshape(batch_size, self._num_digits, total_seq_length)
+        
+        # get random digits from dataset of shape [batch_size, num_digits, 28, 28]
+        digit_images = self._data[self._next_digit_indices(batch_size * self._num_digits)]
+        digit_images = digit_images.reshape(batch_size, self._num_digits,
+                                            self._digit_size, self._digit_size)
+        
+        # pixel offsets within a digit, broadcastable to [batch_size, t, 28, 28]
+        offsets = np.arange(self._digit_size)
+        offsets_y = offsets.reshape(1, 1, -1, 1)
+        offsets_x = offsets.reshape(1, 1, 1, -1)
+        batch_idx = np.arange(batch_size).reshape(-1, 1, 1, 1)
+        time_idx = np.arange(total_seq_length).reshape(1, -1, 1, 1)
+        
+        if out is None:
+            out = np.zeros([batch_size, total_seq_length] + self.input_shape[1:], dtype=np.float32)
+        else:
+            out.fill(0)
+        
+        # view without the channel dimension
+        data = out[..., 0]
+        for n in xrange(self._num_digits):
+            # each frame contains this digit exactly once, so that the indices are unique
+            rows = start_y[:, n, :, np.newaxis, np.newaxis] + offsets_y
+            cols = start_x[:, n, :, np.newaxis, np.newaxis] + offsets_x
+            digits = digit_images[:, n, np.newaxis, :, :]
+            # set data and use maximum for overlap
+            data[batch_idx, time_idx, rows, cols] = np.maximum(data[batch_idx, time_idx, rows, cols],
+                                                               digits)
+        return out
     
-        input_data = np.zeros([batch_size] + self.input_shape, dtype=np.float32)
+    def _split_sequences(self, data):
+        """Splits full-length sequences into inputs and targets without copying.
+        Parameters
+        ----------
+        data: ndarray of shape [batch_size, t_input + t_target, h, w, c]
+            The full-length sequences.
+        Returns
+        ----------
+        The batch tuple (inputs, targets), where targets is None in case
+        the target sequence length is zero.
+        """
+        input_seq_length = self.input_shape[0]
+        input_data = data[:, :input_seq_length]
         
         target_data = None
-        if target_seq_length > 0:
-            target_data = np.zeros([batch_size] + self.target_shape, dtype=np.float32)
-    
-        for j in xrange(batch_size):
-            for n in xrange(self._num_digits):
-       
-                # get random digit from dataset
-                ind = self._indices[self._row]
-                self._row += 1
-                if self._row == self._data.shape[0]:
-                    self.reset()
-                digit_image = self._data[ind, :, :]
+        if self.target_shape[0] > 0:
+            target_data = data[:, input_seq_length:]
         
-                # generate inputs
-                for i in xrange(input_seq_length):
-                    top    = start_y[i, j * self._num_digits + n]
-                    left   = start_x[i, j * self._num_digits + n]
-                    bottom = top  + self._digit_size
-                    right  = left + self._digit_size
-                    # set data and use maximum for overlap
-                    input_data[j, i, top:bottom, left:right, 0] = np.maximum(input_data[j, i, top:bottom, left:right, 0],
-                                                                             digit_image)
-                # generate targets
-                offset = input_seq_length
-                for i in xrange(target_seq_length):
-                    top    = start_y[i + offset, j * self._num_digits + n]
-                    left   = start_x[i + offset, j * self._num_digits + n]
-                    bottom = top  + self._digit_size
-                    right  = left + self._digit_size
-                    # set data and use maximum for overlap
-                    target_data[j, i, top:bottom, left:right, 0] = np.maximum(target_data[j, i, top:bottom, left:right, 0],
-                                                                              digit_image)
         return input_data, target_data
     
+    def _next_digit_indices(self, count):
+        """Gets the next indices of the internal MNIST data.
+        Parameters
+        ----------
+        count: int
+            The number of indices to take.
+        Returns
+        ----------
+        An int array of length 'count' with the MNIST data indices.
+        """
+        indices = np.empty(count, dtype=np.int64)
+        filled = 0
+        while filled < count:
+            num = min(count - filled, self._data.shape[0] - self._row)
+            indices[filled:filled + num] = self._indices[self._row:self._row + num]
+            filled += num
+            self._row += num
+            if self._row == self._data.shape[0]:
+                self.reset()
+        return indices
+    
     @light.utils.attr.override
     def reset(self):
         self._row = 0
@@ -150,19 +205,13 @@ class MovingMNISTBaseGeneratedDataset(base.AbstractDataset):
             x += v_x * step_length
 
             # Bounce off edges.
-            for j in xrange(batch_size):
-                if x[j] <= 0:
-                    x[j] = 0
-                    v_x[j] = -v_x[j]
-                if x[j] >= 1.0:
-                    x[j] = 1.0
-                    v_x[j] = -v_x[j]
-                if y[j] <= 0:
-                    y[j] = 0
-                    v_y[j] = -v_y[j]
-                if y[j] >= 1.0:
-                    y[j] = 1.0
-                    v_y[j] = -v_y[j]
+            bounce_x = np.logical_or(x <= 0, x >= 1.0)
+            bounce_y = np.logical_or(y <= 0, y >= 1.0)
+            v_x[bounce_x] = -v_x[bounce_x]
+            v_y[bounce_y] = -v_y[bounce_y]
+            np.clip(x, 0.0, 1.0, out=x)
+            np.clip(y, 0.0, 1.0, out=y)
+            
             start_y[i, :] = y
             start_x[i, :] = x
 
@@ -176,7 +225,8 @@ class MovingMNISTBaseGeneratedDataset(base.AbstractDataset):
 class MovingMNISTTrainDataset(MovingMNISTBaseGeneratedDataset):
     """Moving MNIST train dataset that creates data on the fly."""
     def __init__(self, data_dir, input_shape=[10, 64, 64, 1], target_shape=[10, 64, 64, 1],
-                 as_binary=False, num_digits=2, step_length=0.1):
+                 as_binary=False, num_digits=2, step_length=0.1,
+                 num_workers=0, slots_per_worker=2, seed=None):
         """Creates a traning MovingMNIST dataset instance.
         Parameters
         ----------
@@ -194,12 +244,200 @@ class MovingMNISTTrainDataset(MovingMNISTBaseGeneratedDataset):
             The number of flying MNIST digits.
         step_length: float, optional
             The step length of movement per frame.
+        num_workers: int, optional
+            The number of worker processes that generate the batches into shared memory.
+            Use 0 (default) to generate the batches in the calling process.
+            Note: In this mode, the returned batches are views into shared memory and
+                  only valid until the next call of get_batch(). It can therefore not be
+                  combined with a light.inputs.BatchPrefetcher, which refuses this dataset.
+        slots_per_worker: int, optional
+            The number of preallocated shared-memory batch buffers per worker.
+        seed: int or None, optional
+            The base random seed of the workers. Worker i uses 'seed + i', so that
+            the generated batches are reproducible. Or None to use a random seed.
         """
+        assert num_workers >= 0, "The number of workers must not be negative."
+        assert slots_per_worker > 0, "At least one slot per worker is required."
+        
+        self._num_workers = num_workers
+        self._slots_per_worker = slots_per_worker
+        self._seed = seed
+        self._pool = None
+        
         dataset_size = sys.maxint
         super(MovingMNISTTrainDataset, self).__init__('train', data_dir, dataset_size,
                                                       input_shape, target_shape,
                                                       as_binary, num_digits, step_length)
     
+    @light.utils.attr.override
+    def get_batch(self, batch_size):
+        if self._num_workers == 0:
+            return super(MovingMNISTTrainDataset, self).get_batch(batch_size)
+        
+        if self._pool is not None and self._pool.batch_size != batch_size:
+            self.close()
+        
+        if self._pool is None:
+            seed = self._seed
+            if seed is None:
+                seed = np.random.randint(np.iinfo(np.int32).max - self._num_workers)
+            self._pool = _SharedMemoryGeneratorPool(self, batch_size, self._num_workers,
+                                                    self._slots_per_worker, seed)
+        
+        return self._split_sequences(self._pool.next_sequences())
+    
+    def close(self):
+        """Stops the worker processes, in case they are running."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+    
+    @property
+    def volatile_batches(self):
+        """Indicates whether the returned batches are views into the shared memory
+           of the worker processes, which are recycled by the next call of get_batch()."""
+        return self._num_workers > 0
+    
+    
+    
+class _SharedMemoryGeneratorPool(object):
+    """Pool of processes that generate Moving MNIST sequences into a ring of
+       preallocated shared-memory buffers.
+       Each worker owns its own slots and the batches are consumed in a round-robin
+       fashion, so that the sequence of batches only depends on the seeds.
+    """
+    def __init__(self, dataset, batch_size, num_workers, slots_per_worker, seed):
+        """Creates the shared memory buffers and starts the workers.
+        Parameters
+        ----------
+        dataset: MovingMNISTBaseGeneratedDataset
+            The dataset to generate the sequences with. Each worker uses a forked copy.
+        batch_size: int
+            The batch size.
+        num_workers: int
+            The number of worker processes.
+        slots_per_worker: int
+            The number of buffers per worker.
+        seed: int
+            The base random seed. Worker i uses 'seed + i'.
+        """
+        self._batch_size = batch_size
+        total_seq_length = dataset.input_shape[0] + dataset.target_shape[0]
+        shape = [batch_size, total_seq_length] + dataset.input_shape[1:]
+        slot_size = int(np.prod(shape))
+        
+        self._slots = []
+        self._free_queues = []
+        self._ready_queues = []
+        self._workers = []
+        for i in xrange(num_workers):
+            slots = []
+            for _ in xrange(slots_per_worker):
+                buf = multiprocessing.RawArray(ctypes.c_float, slot_size)
+                slots.append(np.frombuffer(buf, dtype=np.float32).reshape(shape))
+            free_queue = multiprocessing.Queue()
+            ready_queue = multiprocessing.Queue()
+            for slot in xrange(slots_per_worker):
+                free_queue.put(slot)
+            
+            worker = multiprocessing.Process(target=_generate_into_slots,
+                                             args=(dataset, seed + i, batch_size, slots,
+                                                   free_queue, ready_queue))
+            worker.daemon = True
+            worker.start()
+            
+            self._slots.append(slots)
+            self._free_queues.append(free_queue)
+            self._ready_queues.append(ready_queue)
+            self._workers.append(worker)
+        
+        self._next_worker = 0
+        self._in_use = None
+        
+    def next_sequences(self):
+        """Gets the next generated sequences. The previously returned array
+           is handed back to its worker and must not be used anymore.
+        Returns
+        ----------
+        A view of the shared buffer of shape [batch_size, t_input + t_target, h, w, c].
+        """
+        self._release()
+        
+        worker = self._next_worker
+        while True:
+            # use a timeout to be able to detect a crashed or killed worker
+            try:
+                slot, error = self._ready_queues[worker].get(timeout=1.0)
+                break
+            except queue.Empty:
+                process = self._workers[worker]
+                if not process.is_alive():
+                    raise RuntimeError("Generator worker {} terminated unexpectedly with exit code {}." \
+                                       .format(worker, process.exitcode))
+        if error is not None:
+            raise RuntimeError("Generating sequences failed:\n{}".format(error))
+        self._in_use = (worker, slot)
+        self._next_worker = (worker + 1) % len(self._workers)
+        return self._slots[worker][slot]
+    
+    def close(self):
+        """Stops all worker processes."""
+        self._release()
+        for free_queue in self._free_queues:
+            free_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+    
+    def _release(self):
+        """Hands the slot that is currently in use back to its worker."""
+        if self._in_use is not None:
+            worker, slot = self._in_use
+            self._free_queues[worker].put(slot)
+            self._in_use = None
+    
+    @property
+    def batch_size(self):
+        """Gets the batch size."""
+        return self._batch_size
+    
+    
+def _generate_into_slots(dataset, seed, batch_size, slots, free_queue, ready_queue):
+    """Worker loop that fills the free slots with generated sequences.
+    Parameters
+    ----------
+    dataset: MovingMNISTBaseGeneratedDataset
+        The (forked) dataset to generate the sequences with.
+    seed: int
+        The random seed of this worker.
+    batch_size: int
+        The batch size.
+    slots: list(ndarray)
+        The shared memory buffers owned by this worker.
+    free_queue: multiprocessing.Queue
+        The queue of slot indices that can be filled, or None to terminate.
+    ready_queue: multiprocessing.Queue
+        The queue of tuples (slot, error) of the slot indices that have been filled,
+        or the traceback in case the generation failed.
+    """
+    # shuffle the digits starting from their original order to be reproducible
+    np.random.seed(seed)
+    dataset._indices = np.arange(dataset._data.shape[0])
+    dataset.reset()
+    
+    while True:
+        slot = free_queue.get()
+        if slot is None:
+            return
+        try:
+            dataset._generate_sequences(batch_size, out=slots[slot])
+        except Exception:
+            ready_queue.put((None, traceback.format_exc()))
+            return
+        ready_queue.put((slot, None))
+    
     
     
 class MovingMNISTValidDataset(MovingMNISTBaseGeneratedDataset):
@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 from abc import ABCMeta
 
 import h5py
@@ -25,6 +26,10 @@ HUD_Y = 172
 SUBDIR_TRAIN = "Train"
 SUBDIR_TEST = "Test"
 
+# postfix of the subdirectory that contains the packed frame sequences
+PACKED_POSTFIX = "_packed"
+PACKED_INDEX_FILE = "index.json"
+
 # limit the retires in case we use no-change-skipping
 # to ensure we do not end up in an endless-loop
 MAX_TRIES = 100
@@ -50,6 +55,63 @@ def enough_l2_movement(frames):
         if diff >= MIN_L2_DIFF_PER_FRAME * n:
             return True
     return False
+
+
+def pack_frame_sequences(src_dir, packed_dir):
+    """Packs the PNG frames of each numbered folder into a single uint8 .npy file,
+       that can be memory-mapped. This has to be done only once, because existing
+       packed files are reused.
+    Parameters
+    ----------
+    src_dir: str
+        The directory containing the numbered folders with the PNG frames.
+    packed_dir: str
+        The directory to write the packed .npy files and the index file into.
+    Returns
+    ----------
+    A list of tuples (npy-filepath, frames_count) for each numbered folder, sorted by name.
+    """
+    index_path = os.path.join(packed_dir, PACKED_INDEX_FILE)
+    if os.path.isfile(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    else:
+        if not os.path.exists(packed_dir):
+            os.makedirs(packed_dir)
+        
+        numbered_folder_paths = light.utils.path.get_subdirpaths(src_dir)
+        numbered_folder_paths.sort()
+        
+        print("Packing frame sequences to '{}'...".format(packed_dir))
+        index = []
+        progress = light.utils.ui.ProgressBar(len(numbered_folder_paths))
+        for i, nfp in enumerate(numbered_folder_paths):
+            filenames = light.utils.path.get_filenames(nfp, "*.png", False)
+            filenames.sort()
+            
+            name = os.path.basename(nfp)
+            filepath = os.path.join(packed_dir, name + ".npy")
+            if not os.path.isfile(filepath):
+                # write to a temporary file first to not leave a broken file behind
+                tmp_filepath = filepath + ".tmp"
+                frames = np.lib.format.open_memmap(tmp_filepath, mode='w+', dtype=np.uint8,
+                                                   shape=(len(filenames), FRAME_HEIGHT,
+                                                          FRAME_WIDTH, FRAME_CHANNELS))
+                for fidx, filename in enumerate(filenames):
+                    frames[fidx] = light.utils.image.read(os.path.join(nfp, filename))
+                frames.flush()
+                del frames
+                os.rename(tmp_filepath, filepath)
+            
+            index.append({"name": name, "frames": len(filenames)})
+            progress.update(i + 1)
+        
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+    
+    return [(os.path.join(packed_dir, entry["name"] + ".npy"), entry["frames"])
+            for entry in index]
+
     
 class MsPacmanBaseDataset(base.AbstractDataset):
     """The MsPacman base dataset of the retro game classic.
@@ -60,7 +122,7 @@ class MsPacmanBaseDataset(base.AbstractDataset):
     
     def __init__(self, subdir, index_range, data_dir, input_seq_length=8, target_seq_length=8,
                  crop_size=None, repetitions_per_epoche=256, skip_less_movement=True,
-                 random_flip=True):
+                 random_flip=True, use_packed_frames=False):
         """Creates a MsPacman dataset instance.
         Parameters
         ----------
@@ -89,6 +151,10 @@ class MsPacmanBaseDataset(base.AbstractDataset):
             Whether we do random horizontal flip or not, as the game field is symmetric.
             In case cropping is active, we do not flip the frame in case the score-board
             at the bottom is visible.
+        use_packed_frames: Boolean, optional
+            Whether to pack the PNG frames of each sequence into a memory-mapped file once,
+            which avoids decoding the PNG files on every batch. This requires about 100 KB
+            of disk space per frame.
         """
         # check or notify manual download
         filepath = os.path.join(data_dir, MSPAC_FILENAME)
@@ -99,21 +165,40 @@ class MsPacmanBaseDataset(base.AbstractDataset):
         self._data_dir = dataset_path
         
         train_dir = os.path.join(dataset_path, subdir)
-        numbered_folder_paths = light.utils.path.get_subdirpaths(train_dir)
-        numbered_folder_paths.sort()
-        
-        if index_range is not None:
-            # take only a specific part of the data
-            numbered_folder_paths = numbered_folder_paths[index_range[0]:index_range[1]+1]
         
-        # we save the file names, as well, to reduce string-ops at runtime
-        # and names to not start with zero (0000.png)
-        #data = [("path", files_count, [filenames])]
-        data = []
-        for nfp in numbered_folder_paths:
-            filenames = light.utils.path.get_filenames(nfp, "*.png", False)
-            filenames.sort()
-            data.append((nfp, len(filenames), filenames))
+        if use_packed_frames:
+            packed_dir = os.path.join(dataset_path, subdir + PACKED_POSTFIX)
+            packed_sequences = pack_frame_sequences(train_dir, packed_dir)
+            
+            if index_range is not None:
+                # take only a specific part of the data
+                packed_sequences = packed_sequences[index_range[0]:index_range[1]+1]
+            
+            #data = [("path", files_count, None)]
+            data = [(filepath, frames_count, None) for filepath, frames_count in packed_sequences]
+            self._packed_frames = [np.load(filepath, mmap_mode='r') for filepath, _ in packed_sequences]
+        else:
+            # use a cached listing of all frames, grouped by the numbered folders
+            filenames_per_folder = {}
+            for frame_path in light.utils.path.get_filenames_cached(train_dir, "*.png"):
+                nfp, filename = os.path.split(frame_path)
+                filenames_per_folder.setdefault(nfp, []).append(filename)
+            
+            numbered_folder_paths = sorted(filenames_per_folder.keys())
+            
+            if index_range is not None:
+                # take only a specific part of the data
+                numbered_folder_paths = numbered_folder_paths[index_range[0]:index_range[1]+1]
+            
+            # we save the file names, as well, to reduce string-ops at runtime
+            # and names to not start with zero (0000.png)
+            #data = [("path", files_count, [filenames])]
+            data = []
+            for nfp in numbered_folder_paths:
+                filenames = filenames_per_folder[nfp]
+                filenames.sort()
+                data.append((nfp, len(filenames), filenames))
+            self._packed_frames = None
             
         self._data = data
         
@@ -161,6 +246,7 @@ class MsPacmanBaseDataset(base.AbstractDataset):
         
         for batch in xrange(batch_size):
             current_seq = self._data[seq_indices[batch]]
+            current_seq_index = seq_indices[batch]
             
             # select random frame index to start
             start_idx = random.randint(0, current_seq[1] - total_seq_len)
@@ -173,12 +259,9 @@ class MsPacmanBaseDataset(base.AbstractDataset):
                     
             # pre-load input-frames fist. Because we do not need to process all
             # target frames in case we have to do a re-try due to "no-change" of pixels
-            input_frames = []
-            for fidx in xrange(start_idx, start_idx + self._input_seq_length):
-                frame_path = os.path.join(current_seq[0], current_seq[2][fidx])
-                input_frames.append(light.utils.image.read(frame_path))
+            input_frames = self._read_frames(current_seq_index, start_idx, self._input_seq_length)
                 
-                """# pre-load images
+            """# pre-load images
             input_frames = []
             target_frames = []
             for i, fidx in enumerate(xrange(start_idx, start_idx + total_seq_len)):
@@ -220,11 +303,10 @@ class MsPacmanBaseDataset(base.AbstractDataset):
                         
                 # we reach this, when the input sequence was valid and we can now
                 # start to process the targets as well
-                for i, fidx in enumerate(xrange(start_idx + self._input_seq_length, start_idx + total_seq_len)):
-                    current_path = current_seq[0]
-                    current_filename = current_seq[2][fidx]
-                    frame_path = os.path.join(current_path, current_filename)
-                    frame = light.utils.image.read(frame_path)
+                target_frames = self._read_frames(current_seq_index, start_idx + self._input_seq_length,
+                                                  self._target_seq_length)
+                for i in xrange(self._target_seq_length):
+                    frame = target_frames[i]
                     
                     if self._crop_size is not None:
                         # crop image
@@ -243,6 +325,31 @@ class MsPacmanBaseDataset(base.AbstractDataset):
         
         return batch_inputs, batch_targets
     
+    def _read_frames(self, seq_index, start_idx, count):
+        """Reads consecutive frames of a sequence.
+        Parameters
+        ----------
+        seq_index: int
+            The index of the sequence.
+        start_idx: int
+            The index of the first frame.
+        count: int
+            The number of frames to read.
+        Returns
+        ----------
+        A list or an array of 'count' frames with shape [h, w, c]. In case of packed
+        frames, this is a memory-mapped view, which is only read when accessed.
+        """
+        if self._packed_frames is not None:
+            return self._packed_frames[seq_index][start_idx:(start_idx + count)]
+        
+        current_seq = self._data[seq_index]
+        frames = []
+        for fidx in xrange(start_idx, start_idx + count):
+            frame_path = os.path.join(current_seq[0], current_seq[2][fidx])
+            frames.append(light.utils.image.read(frame_path))
+        return frames
+    
     @light.utils.attr.override
     def reset(self):
         pass
@@ -255,7 +362,7 @@ class MsPacmanTrainDataset(MsPacmanBaseDataset):
     """
     def __init__(self, data_dir, input_seq_length=10, target_seq_length=10,
                  crop_size=None, repetitions_per_epoche=256, skip_less_movement=True,
-                 random_flip=True):
+                 random_flip=True, use_packed_frames=False):
         """Creates a MsPacman dataset instance.
         Parameters
         ----------
@@ -279,9 +386,13 @@ class MsPacmanTrainDataset(MsPacmanBaseDataset):
             Whether we do random horizontal flip or not, as the game field is symmetric.
             In case cropping is active, we do not flip the frame in case the score-board
             at the bottom is visible.
+        use_packed_frames: Boolean, optional
+            Whether to pack the PNG frames of each sequence into a memory-mapped file once,
+            which avoids decoding the PNG files on every batch.
         """
         super(MsPacmanTrainDataset, self).__init__(SUBDIR_TRAIN, (0, 465), data_dir, input_seq_length, target_seq_length,
-                                                   crop_size, repetitions_per_epoche, skip_less_movement, random_flip)
+                                                   crop_size, repetitions_per_epoche, skip_less_movement, random_flip,
+                                                   use_packed_frames)
     
     
 class MsPacmanValidDataset(MsPacmanBaseDataset):
@@ -291,7 +402,7 @@ class MsPacmanValidDataset(MsPacmanBaseDataset):
     """
     def __init__(self, data_dir, input_seq_length=10, target_seq_length=10,
                  crop_size=None, repetitions_per_epoche=256, skip_less_movement=True,
-                 random_flip=True):
+                 random_flip=True, use_packed_frames=False):
         """Creates a MsPacman dataset instance.
         Parameters
         ----------
@@ -315,9 +426,13 @@ class MsPacmanValidDataset(MsPacmanBaseDataset):
             Whether we do random horizontal flip or not, as the game field is symmetric.
             In case cropping is active, we do not flip the frame in case the score-board
             at the bottom is visible.
+        use_packed_frames: Boolean, optional
+            Whether to pack the PNG frames of each sequence into a memory-mapped file once,
+            which avoids decoding the PNG files on every batch.
         """
         super(MsPacmanValidDataset, self).__init__(SUBDIR_TRAIN, (466 ,516), data_dir, input_seq_length, target_seq_length,
-                                                   crop_size, repetitions_per_epoche, skip_less_movement, random_flip)
+                                                   crop_size, repetitions_per_epoche, skip_less_movement, random_flip,
+                                                   use_packed_frames)
         
 
 class MsPacmanTestDataset(MsPacmanBaseDataset):
@@ -327,7 +442,7 @@ class MsPacmanTestDataset(MsPacmanBaseDataset):
     """
     def __init__(self, data_dir, input_seq_length=10, target_seq_length=10,
                  crop_size=None, repetitions_per_epoche=256, skip_less_movement=True,
-                 random_flip=True):
+                 random_flip=True, use_packed_frames=False):
         """Creates a MsPacman dataset instance.
         Parameters
         ----------
@@ -351,6 +466,10 @@ class MsPacmanTestDataset(MsPacmanBaseDataset):
             Whether we do random horizontal flip or not, as the game field is symmetric.
             In case cropping is active, we do not flip the frame in case the score-board
             at the bottom is visible.
+        use_packed_frames: Boolean, optional
+            Whether to pack the PNG frames of each sequence into a memory-mapped file once,
+            which avoids decoding the PNG files on every batch.
         """
         super(MsPacmanTestDataset, self).__init__(SUBDIR_TEST, None, data_dir, input_seq_length, target_seq_length,
-                                                  crop_size, repetitions_per_epoche, skip_less_movement, random_flip)
\ No newline at end of file
+                                                  crop_size, repetitions_per_epoche, skip_less_movement, random_flip,
+                                                  use_packed_frames)
\ No newline at end of file
@@ -31,7 +31,7 @@ class UCF101TrainDataset(base.AbstractQueueDataset):
                  image_scale_factor=1.0, gray_scale=False,
                  min_examples_in_queue=1024, queue_capacitiy=2048, num_threads=16,
                  serialized_sequence_length=30, do_distortion=True, crop_size=None,
-                 skip_less_movement=True):
+                 skip_less_movement=True, shard_size=None):
         """Creates a training dataset instance that uses a queue.
         Parameters
         ----------
@@ -61,6 +61,10 @@ class UCF101TrainDataset(base.AbstractQueueDataset):
             The size (height, width) to randomly crop the images.
         skip_less_movement: Boolean, optional
             Skip frame sequences where there is too less movement in the inputs at all,
+        shard_size: int or None, optional
+            The maximum size in bytes of a shard file, when the frame sequences should be
+            serialized into a few large shard files. Use None to serialize each sequence
+            into its own .seq file.
         """
         image_size = [int(FRAME_HEIGHT * image_scale_factor),
                       int(FRAME_WIDTH * image_scale_factor),
@@ -76,6 +80,7 @@ class UCF101TrainDataset(base.AbstractQueueDataset):
         self._crop_size = crop_size
         self._skip_less_movement = skip_less_movement
         self._data_img_size = image_size
+        self._shard_size = shard_size
         
         rar_path = light.utils.data.download(UCF101_URL, data_dir)
 
@@ -91,7 +96,11 @@ class UCF101TrainDataset(base.AbstractQueueDataset):
                                                                   train_files,
                                                                   [FRAME_HEIGHT, FRAME_WIDTH, FRAME_CHANNELS],
                                                                   serialized_sequence_length,
-                                                                  gray_scale, image_scale_factor)
+                                                                  gray_scale, image_scale_factor,
+                                                                  shard_size=shard_size)
+        if shard_size is not None:
+            # the shards contain fixed-length records only, which can be read directly
+            seq_files = sorted(set(shard_path for shard_path, _ in seq_files))
         self._file_name_list = seq_files
         
         if crop_size is None:
@@ -283,7 +292,8 @@ class UCF101BaseEvaluationDataset(base.AbstractDataset):
     def __init__(self, data_dir, subdir, input_seq_length=5, target_seq_length=5,
                  image_scale_factor=1.0, gray_scale=False,
                  serialized_sequence_length=30, double_with_flipped=False,
-                 crop_size=None, repetitions_per_epoche=4, skip_less_movement=True):
+                 crop_size=None, repetitions_per_epoche=4, skip_less_movement=True,
+                 shard_size=None):
         """Creates a dataset instance.
         Parameters
         ----------
@@ -314,6 +324,10 @@ class UCF101BaseEvaluationDataset(base.AbstractDataset):
             part each time. If we would not, Testing could vary each evaluation a lot.
         skip_less_movement: Boolean, optional
             Skip frame sequences where there is too less movement in the inputs at all.
+        shard_size: int or None, optional
+            The maximum size in bytes of a shard file, when the frame sequences should be
+            serialized into a few large shard files. Use None to serialize each sequence
+            into its own .seq file.
         """
         image_size = [int(FRAME_HEIGHT * image_scale_factor),
                       int(FRAME_WIDTH * image_scale_factor),
@@ -328,6 +342,7 @@ class UCF101BaseEvaluationDataset(base.AbstractDataset):
         self._crop_size = crop_size
         self._skip_less_movement = skip_less_movement
         self._data_img_size = image_size
+        self._shard_size = shard_size
         
         rar_path = light.utils.data.download(UCF101_URL, data_dir)
 
@@ -343,8 +358,10 @@ class UCF101BaseEvaluationDataset(base.AbstractDataset):
         dataset_size, seq_files = light.utils.data.preprocess_videos(dataset_path, subdir, eval_files[eval_index],
                                                                   [FRAME_HEIGHT, FRAME_WIDTH, FRAME_CHANNELS],
                                                                   serialized_sequence_length,
-                                                                  gray_scale, image_scale_factor)
+                                                                  gray_scale, image_scale_factor,
+                                                                  shard_size=shard_size)
         self._file_name_list = seq_files
+        self._seq_reader = light.utils.data.SequenceFileReader(image_size)
         
         # even if the dataset size is doubled, use the original
         # size for the indices list to reduce its size...
@@ -416,15 +433,18 @@ class UCF101BaseEvaluationDataset(base.AbstractDataset):
         for i, f in enumerate(file_names):
             virtual_row = self._row + i
                                        
-            current = light.utils.image.read_as_binary(f, dtype=np.uint8)
-            current = np.reshape(current, [self.serialized_sequence_length] + list(self._data_img_size))
-            
             # select random part of the sequence with length of inputs+targets
             inputs_length = self.input_shape[0]
             targets_length = self.target_shape[0]
             total_length = inputs_length + targets_length
             start_t = random.randint(0, self.serialized_sequence_length - total_length)
-            current = current[start_t:(start_t + total_length)]
+            
+            # read only the selected frames from the memory-mapped file
+            if self._shard_size is not None:
+                shard_path, offset = f
+                current = self._seq_reader.read(shard_path, start_t, total_length, offset=offset)
+            else:
+                current = self._seq_reader.read(f, start_t, total_length)
             
             if self._crop_size is not None:
                 for retry in xrange(MAX_TRIES):
@@ -498,7 +518,8 @@ class UCF101ValidDataset(UCF101BaseEvaluationDataset):
     def __init__(self, data_dir, input_seq_length=5, target_seq_length=5,
                  image_scale_factor=1.0, gray_scale=False,
                  serialized_sequence_length=30, double_with_flipped=False,
-                 crop_size=None, repetitions_per_epoche=4, skip_less_movement=True):
+                 crop_size=None, repetitions_per_epoche=4, skip_less_movement=True,
+                 shard_size=None):
         """Creates a validation dataset instance.
         Parameters
         ----------
@@ -527,12 +548,16 @@ class UCF101ValidDataset(UCF101BaseEvaluationDataset):
             part each time. If we would not, Testing could vary each evaluation a lot.
         skip_less_movement: Boolean, optional
             Skip frame sequences where there is too less movement in the inputs at all.
+        shard_size: int or None, optional
+            The maximum size in bytes of a shard file, when the frame sequences should be
+            serialized into a few large shard files. Use None to serialize each sequence
+            into its own .seq file.
         """
         super(UCF101ValidDataset, self).__init__(data_dir, light.utils.data.SUBDIR_VALID,
                                                  input_seq_length, target_seq_length,
                                                  image_scale_factor, gray_scale, serialized_sequence_length,
                                                  double_with_flipped, crop_size,
-                                                 repetitions_per_epoche, skip_less_movement)
+                                                 repetitions_per_epoche, skip_less_movement, shard_size)
         
         
 class UCF101TestDataset(UCF101BaseEvaluationDataset):    
@@ -548,7 +573,8 @@ class UCF101TestDataset(UCF101BaseEvaluationDataset):
     def __init__(self, data_dir, input_seq_length=5, target_seq_length=5,
                  image_scale_factor=1.0, gray_scale=False,
                  serialized_sequence_length=30, double_with_flipped=False,
-                 crop_size=None, repetitions_per_epoche=8, skip_less_movement=True):
+                 crop_size=None, repetitions_per_epoche=8, skip_less_movement=True,
+                 shard_size=None):
         """Creates a validation dataset instance.
         Parameters
         ----------
@@ -577,9 +603,13 @@ class UCF101TestDataset(UCF101BaseEvaluationDataset):
             part each time. If we would not, Testing could vary each evaluation a lot.
         skip_less_movement: Boolean, optional
             Skip frame sequences where there is too less movement in the inputs at all.
+        shard_size: int or None, optional
+            The maximum size in bytes of a shard file, when the frame sequences should be
+            serialized into a few large shard files. Use None to serialize each sequence
+            into its own .seq file.
         """
         super(UCF101TestDataset, self).__init__(data_dir, light.utils.data.SUBDIR_TEST,
                                                 input_seq_length, target_seq_length,
                                                 image_scale_factor, gray_scale, serialized_sequence_length, 
                                                 double_with_flipped, crop_size,
-                                                repetitions_per_epoche, skip_less_movement)
\ No newline at end of file
+                                                repetitions_per_epoche, skip_less_movement, shard_size)
\ No newline at end of file
@@ -75,7 +75,7 @@ class UCF11TrainDataset(base.AbstractQueueDataset):
         self._data_dir = dataset_path
         
         # generate frame sequences.
-        video_filenames = light.utils.path.get_filenames(dataset_path, '*.mpg')
+        video_filenames = light.utils.path.get_filenames_cached(dataset_path, '*.mpg')
         dataset_size, seq_files = light.utils.data.preprocess_videos(dataset_path, SUBDIR_SHARED,
                                                           video_filenames,
                                                           [FRAME_HEIGHT, FRAME_WIDTH, FRAME_CHANNELS],
@@ -238,7 +238,7 @@ class UCF11ValidDataset(base.AbstractDataset):
         self._data_dir = dataset_path
         
         # generate frame sequences.
-        video_filenames = light.utils.path.get_filenames(dataset_path, '*.mpg')
+        video_filenames = light.utils.path.get_filenames_cached(dataset_path, '*.mpg')
         dataset_size, seq_files = light.utils.data.preprocess_videos(dataset_path, SUBDIR_SHARED,
                                                                   video_filenames,
                                                                   [FRAME_HEIGHT, FRAME_WIDTH, FRAME_CHANNELS],
@@ -246,6 +246,7 @@ class UCF11ValidDataset(base.AbstractDataset):
                                                                   gray_scale, image_scale_factor)
         
         self._file_name_list = seq_files
+        self._seq_reader = light.utils.data.SequenceFileReader(image_size)
         self._indices = range(dataset_size)
         self._row = 0
         
@@ -285,15 +286,14 @@ class UCF11ValidDataset(base.AbstractDataset):
         seq_input_list = []
         seq_target_list = []
         for f in file_names:
-            current = light.utils.image.read_as_binary(f, dtype=np.uint8)
-            current = np.reshape(current, [self.serialized_sequence_length] + list(self._data_img_size))
-            
             # select random part of the sequence with length of inputs+targets
             inputs_length = self.input_shape[0]
             targets_length = self.target_shape[0]
             total_length = inputs_length + targets_length
             start_t = random.randint(0, self.serialized_sequence_length - total_length)
-            current = current[start_t:(start_t + total_length)]
+            
+            # read only the selected frames from the memory-mapped file
+            current = self._seq_reader.read(f, start_t, total_length)
             
             if self._crop_size is not None:
                 current = current[:, offset_y:(offset_y+self._crop_size[0]),
@@ -96,6 +96,13 @@ def equal_random_distortion(images, contrast_lower=0.8, contrast_upper=1.2, brig
         return images
 
 
+def _to_float32(img):
+    """Casts the image to float32, in case it has a lower precision."""
+    if img.dtype.base_dtype == tf.float32:
+        return img
+    return tf.cast(img, tf.float32)
+
+
 def _fspecial_gauss(size, sigma):
     """Function to mimic the 'fspecial' gaussian MATLAB function
     Parameters
@@ -165,6 +172,9 @@ def ssim(img1, img2, patch_size=11, sigma=1.5, L=1.0, K1=0.01, K2=0.03,
         they are identical and '0' means they are completely different.
     """
     with tf.name_scope('SSIM'):
+        # keep the metrics in full precision, also for float16 models
+        img1 = _to_float32(img1)
+        img2 = _to_float32(img2)
         window = _fspecial_gauss(patch_size, sigma)
         C1 = (K1*L)**2
         C2 = (K2*L)**2
@@ -244,6 +254,9 @@ def ms_ssim(img1, img2, patch_size=11, sigma=1.5, L=1.0, K1=0.01, K2=0.03,
     assert levels >= 2 and levels <= 5, "Levels must be in range [2, 5]."
 
     with tf.name_scope('MSSSIM'):
+        # keep the metrics in full precision, also for float16 models
+        img1 = _to_float32(img1)
+        img2 = _to_float32(img2)
         weights = tf.constant(level_weights, dtype=tf.float32, name="level_weights")
         mssim = None
         mcs = []
@@ -309,6 +322,9 @@ def ss_ssim(img1, img2, patch_size=11, sigma=1.5, L=1.0, K1=0.01, K2=0.03, level
         where '1' means they are identical and '0' means they are completely different.
     """
     with tf.name_scope('SSSSIM'):
+        # keep the metrics in full precision, also for float16 models
+        img1 = _to_float32(img1)
+        img2 = _to_float32(img2)
         # down sampling
         for l in xrange(level - 1):
             # ndimage.filters.convolve(img, downsample_filter, mode='reflect')
@@ -345,6 +361,9 @@ def psnr(img1, img2, max_value=1.0, name=None):
         loss are considered to be about 20 dB to 25 dB.
     """
     with tf.name_scope('PSNR'):
+        # keep the metrics in full precision, also for float16 models
+        img1 = _to_float32(img1)
+        img2 = _to_float32(img2)
         shape = tf.shape(img1)
 
         N = tf.to_float(shape[1] * shape[2] * shape[3])
@@ -378,6 +397,9 @@ def sharp_diff(img1, img2, max_value=1.0, name=None):
         The mean Sharpness Differences error over each frame in the batch.
     """
     with tf.name_scope('SHARP_DIFF'):
+        # keep the metrics in full precision, also for float16 models
+        img1 = _to_float32(img1)
+        img2 = _to_float32(img2)
         shape = img1.get_shape().as_list()
         
         N = tf.to_float(shape[1] * shape[2] * shape[3])
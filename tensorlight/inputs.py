@@ -1,7 +1,17 @@
+import random
+import threading
+import traceback
+import multiprocessing
+from six.moves import queue
+
 import numpy as np
 import tensorflow as tf
 
 
+PREFETCH_THREAD = 'thread'
+PREFETCH_PROCESS = 'process'
+
+
 def generate_batch(inputs, target, batch_size, min_queue_examples,
                    queue_capacitiy, shuffle=True, num_threads=8):
     """Construct a queued batch of data (e.g images) and labels.
@@ -48,4 +58,187 @@ def generate_batch(inputs, target, batch_size, min_queue_examples,
             num_threads=num_threads,
             capacity=queue_capacitiy)
 
-    return inputs_batch, target_batch
\ No newline at end of file
+    return inputs_batch, target_batch
+
+
+def _prefetch_worker(dataset, batch_size, batch_queue, stop_event, lock=None, seed=None):
+    """Worker loop that produces batches of a dataset ahead of time.
+    Parameters
+    ----------
+    dataset: AbstractDataset
+        The dataset to fetch the batches from.
+    batch_size: int
+        The batch size.
+    batch_queue: Queue
+        The queue where the batch tuples (inputs, targets, error) are put into.
+    stop_event: Event
+        The event that signals the worker to terminate.
+    lock: Lock or None, optional
+        The lock to synchronize the dataset access in case the workers share
+        the same dataset instance (thread mode).
+    seed: int or None, optional
+        The seed to re-initialize the random generators, which is required
+        when the worker runs on a forked copy of the dataset (process mode).
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    
+    while not stop_event.is_set():
+        try:
+            if lock is not None:
+                with lock:
+                    batch_x, batch_y = dataset.get_batch(batch_size)
+            else:
+                batch_x, batch_y = dataset.get_batch(batch_size)
+            item = (batch_x, batch_y, None)
+        except Exception:
+            item = (None, None, traceback.format_exc())
+        
+        # use a timeout to be able to react on the stop event
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        
+        if item[2] is not None:
+            return
+
+
+class BatchPrefetcher(object):
+    """Prefetches batches of a feeding dataset in the background, so that the
+       batch generation in Python overlaps with the computation of the graph.
+    """
+    def __init__(self, dataset, batch_size, queue_depth=4, num_workers=1,
+                 mode=PREFETCH_THREAD):
+        """Creates a batch prefetcher instance.
+        Parameters
+        ----------
+        dataset: AbstractDataset
+            The dataset to fetch the batches from. Queue datasets
+            are not supported, as these already use an input queue.
+        batch_size: int
+            The batch size.
+        queue_depth: int, optional
+            The maximum number of batches that are prepared in advance.
+        num_workers: int, optional
+            The number of workers that produce the batches.
+        mode: str, optional
+            Use light.inputs.PREFETCH_THREAD to produce the batches in threads. The dataset
+            access is synchronized, so that threads are only useful as long as the dataset
+            does not hold the GIL, e.g. while doing I/O or NumPy ops.
+            Use light.inputs.PREFETCH_PROCESS to produce the batches in processes. Each process
+            works on its own (forked) copy of the dataset using a different random seed, which
+            is only suitable for datasets that sample their examples randomly.
+        """
+        assert queue_depth > 0, "The queue depth has to be positive."
+        assert num_workers > 0, "The number of workers has to be positive."
+        assert mode in (PREFETCH_THREAD, PREFETCH_PROCESS), "Unknown prefetch mode."
+        if dataset.volatile_batches:
+            raise ValueError("Batches of this dataset are only valid until the next batch is fetched " \
+                             "and cannot be prefetched. Disable the prefetching or its workers.")
+        
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._queue_depth = queue_depth
+        self._num_workers = num_workers
+        self._mode = mode
+        
+        self._queue = None
+        self._stop_event = None
+        self._workers = []
+        
+    def __enter__(self):
+        """Enters the context manager and starts the workers."""
+        self.start()
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        """Exits the context manager and stops the workers."""
+        self.stop()
+        
+    def start(self):
+        """Starts the workers to prefetch the batches."""
+        if self.running:
+            return
+        
+        if self._mode == PREFETCH_THREAD:
+            self._queue = queue.Queue(maxsize=self._queue_depth)
+            self._stop_event = threading.Event()
+            lock = threading.Lock()
+            for i in xrange(self._num_workers):
+                worker = threading.Thread(target=_prefetch_worker,
+                                          args=(self._dataset, self._batch_size,
+                                                self._queue, self._stop_event, lock))
+                self._workers.append(worker)
+        else:
+            self._queue = multiprocessing.Queue(maxsize=self._queue_depth)
+            self._stop_event = multiprocessing.Event()
+            for i in xrange(self._num_workers):
+                # derive the seeds from the global generator to stay reproducible
+                seed = np.random.randint(np.iinfo(np.int32).max)
+                worker = multiprocessing.Process(target=_prefetch_worker,
+                                                 args=(self._dataset, self._batch_size,
+                                                       self._queue, self._stop_event, None, seed))
+                self._workers.append(worker)
+        
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+    
+    def get_batch(self):
+        """Gets the next prefetched batch.
+        Returns
+        ----------
+        The next batch tuple (inputs, targets).
+        """
+        assert self.running, "Start the prefetcher first."
+        
+        while True:
+            # use a timeout to be able to detect a crashed or killed worker
+            try:
+                batch_x, batch_y, error = self._queue.get(timeout=1.0)
+                break
+            except queue.Empty:
+                for i, worker in enumerate(self._workers):
+                    if not worker.is_alive():
+                        raise RuntimeError("Prefetch worker {} terminated unexpectedly with exit code {}." \
+                                           .format(i, getattr(worker, 'exitcode', None)))
+        if error is not None:
+            raise RuntimeError("Prefetching a batch failed:\n{}".format(error))
+        return batch_x, batch_y
+    
+    def stop(self):
+        """Stops all workers and releases the queue."""
+        if not self.running:
+            return
+        
+        self._stop_event.set()
+        
+        # drain the queue to unblock the workers
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        
+        for worker in self._workers:
+            worker.join(timeout=5.0)
+            if self._mode == PREFETCH_PROCESS and worker.is_alive():
+                worker.terminate()
+        
+        self._workers = []
+        self._queue = None
+        self._stop_event = None
+    
+    @property
+    def running(self):
+        """Indicates whether the workers are running."""
+        return len(self._workers) > 0
+    
+    @property
+    def batch_size(self):
+        """Gets the batch size."""
+        return self._batch_size
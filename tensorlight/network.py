@@ -36,7 +36,8 @@ def get_variable(name, shape=None, dtype=tf.float32, initializer=None, regulariz
         The device to which memory the variables will get stored on. (e.g. '/cpu:0')
     Returns
     ----------
-    The created or existing variable.
+    The created or existing variable. In case of dtype float16, the variable itself
+    is stored in float32 and the returned tensor is its float16 cast (mixed precision).
 
     Raises
     ----------
@@ -44,6 +45,11 @@ def get_variable(name, shape=None, dtype=tf.float32, initializer=None, regulariz
                 or when violating reuse during variable creation.
                 Reuse is set inside variable_scope.
     """
+    # keep float32 master weights for half precision
+    compute_dtype = tf.as_dtype(dtype)
+    if compute_dtype == tf.float16:
+        dtype = tf.float32
+    
     if device is not None:
         # specific device
         with tf.device(device):
@@ -55,6 +61,9 @@ def get_variable(name, shape=None, dtype=tf.float32, initializer=None, regulariz
         var = tf.get_variable(name, shape, dtype, initializer, regularizer,
                               trainable, collections, caching_device, partitioner, 
                               validate_shape)
+    
+    if compute_dtype != var.dtype.base_dtype:
+        return tf.cast(var, compute_dtype)
     return var
 
 
@@ -154,6 +163,7 @@ def conv2d(name_or_scope, x, n_filters,
         
         w = get_variable(
             'W', [ksize[0], ksize[1], x.get_shape()[-1], n_filters],
+            dtype=x.dtype.base_dtype,
             initializer=weight_init_func,
             regularizer=regularizer,
             device=device)
@@ -169,6 +179,7 @@ def conv2d(name_or_scope, x, n_filters,
                 raise ValueError("Parameter bias_init must be float or function or None.")
             b = get_variable(
                 'b', [n_filters],
+                dtype=x.dtype.base_dtype,
                 initializer=bias_init_func,
                 device=device)
             linearity = tf.nn.bias_add(conv, b)
@@ -238,6 +249,7 @@ def conv2d_transpose(name_or_scope,
         
         w = get_variable(
             'W', [ksize[0], ksize[1], n_filters, static_input_shape[3]],
+            dtype=x.dtype.base_dtype,
             initializer=weight_init_func,
             regularizer=regularizer,
             device=device)
@@ -265,6 +277,7 @@ def conv2d_transpose(name_or_scope,
                 raise ValueError("Parameter bias_init must be float or function or None.")
             b = get_variable(
                 'b', [n_filters],
+                dtype=x.dtype.base_dtype,
                 initializer=bias_init_func,
                 device=device)
             linearity = tf.nn.bias_add(convt, b)
@@ -348,7 +361,7 @@ def fc(name_or_scope, x, n_units,
         else:
             raise ValueError("Parameter weight_init must be float or function.")
         
-        w = get_variable("W", [shape[1], n_units], tf.float32,
+        w = get_variable("W", [shape[1], n_units], x.dtype.base_dtype,
                             initializer=weight_init_func,
                             regularizer=regularizer,
                             device=device)
@@ -363,6 +376,7 @@ def fc(name_or_scope, x, n_units,
                 raise ValueError("Parameter bias_init must be float or function or None.")
             b = get_variable(
                 'b', [n_units],
+                dtype=x.dtype.base_dtype,
                 initializer=bias_init_func,
                 device=device)
             linearity = tf.nn.bias_add(mul, b)
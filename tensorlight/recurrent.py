@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import re
+import types
+import itertools
 import collections
 import six
 
@@ -9,12 +12,13 @@ import tensorflow as tf
 import tensorlight as light
 
 from tensorflow.python.ops import variable_scope as vs
+from tensorflow.python.framework import function
 
 from tensorflow.python.util import nest
 
 
 def rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
-        sequence_length=None, scope=None):
+        sequence_length=None, recompute_interval=None, scope=None):
     """Creates a recurrent neural network specified by RNNConv2DCell `cell`.
     The simplest form of RNN network generated is:
         state = cell.zero_state(...)
@@ -49,6 +53,11 @@ def rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
             initial_state is not provided.
         sequence_length: Specifies the length of each sequence in inputs.
                          An int32 or int64 vector (tensor) size `[batch_size]`, values in `[0, T)`.
+        recompute_interval: (optional) The number of timesteps of which only the state of
+                            the first is kept for the backward pass, while the activations of
+                            all others are recomputed. Use None to keep all activations.
+                            The cell must only use trainable variables within the RNN scope,
+                            because no gradients flow to others (ValueError otherwise).
         scope: VariableScope for the created subgraph; defaults to "RNNConv2D".
     Returns:
         A pair (outputs, state) where:
@@ -67,7 +76,6 @@ def rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
     if not inputs:
         raise ValueError("inputs must not be empty")
 
-    outputs = []
     # Create a new scope in which the caching device is either
     # determined by the parent scope, or is set to place the cached
     # Variable using the same placement as for the rest of the RNN.
@@ -114,13 +122,10 @@ def rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
             min_sequence_length = tf.reduce_min(sequence_length)
             max_sequence_length = tf.reduce_max(sequence_length)
 
-        for time, input_ in enumerate(inputs):
-            if time > 0: varscope.reuse_variables()
-            # pylint: disable=cell-var-from-loop
+        def step(time, prev_output, input_, state):
             call_cell = lambda: cell(input_, state)
-            # pylint: enable=cell-var-from-loop
             if sequence_length is not None:
-                (output, state) = tf.nn.rnn._rnn_step(
+                return tf.nn.rnn._rnn_step(
                     time=time,
                     sequence_length=sequence_length,
                     min_sequence_length=min_sequence_length,
@@ -130,15 +135,16 @@ def rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
                     call_cell=call_cell,
                     state_size=cell.state_size)
             else:
-                (output, state) = call_cell()
+                return call_cell()
 
-            outputs.append(output)
+        outputs, state = _unroll_conv2d(step, len(inputs), None, state, inputs,
+                                        recompute_interval, varscope)
 
         return (outputs, state)
     
     
 def rnn_conv2d_roundabout(cell, single_input, sequence_length, initial_state=None,
-                          dtype=tf.float32, scope=None):
+                          dtype=tf.float32, recompute_interval=None, scope=None):
     """Creates a recurrent neural network specified by RNNConv2DCell `cell`, that has only
        a single input, and reuses the last output as its new input.
     Args:
@@ -153,6 +159,11 @@ def rnn_conv2d_roundabout(cell, single_input, sequence_length, initial_state=Non
             tensors having shapes `[batch_size, s] for s in cell.state_size`.
         dtype: (optional) The data type for the initial state.  Required if
             initial_state is not provided.
+        recompute_interval: (optional) The number of timesteps of which only the state of
+                            the first is kept for the backward pass, while the activations of
+                            all others are recomputed. Use None to keep all activations.
+                            The cell must only use trainable variables within the RNN scope,
+                            because no gradients flow to others (ValueError otherwise).
         scope: VariableScope for the created subgraph; defaults to "RNNConv2D".
     Returns:
         A pair (outputs, state) where:
@@ -170,7 +181,6 @@ def rnn_conv2d_roundabout(cell, single_input, sequence_length, initial_state=Non
     if single_input is None:
         raise ValueError("single_input must not be empty")
 
-    outputs = []
     # Create a new scope in which the caching device is either
     # determined by the parent scope, or is set to place the cached
     # Variable using the same placement as for the rest of the RNN.
@@ -200,24 +210,16 @@ def rnn_conv2d_roundabout(cell, single_input, sequence_length, initial_state=Non
                                  "dtype must be specified")
             state = cell.zero_state(batch_size, dtype)
 
-        input_ = single_input
-        for time in xrange(sequence_length):
-            if time > 0:
-                varscope.reuse_variables()
-            
-            # pylint: disable=cell-var-from-loop
-            call_cell = lambda: cell(input_, state)
-            # pylint: enable=cell-var-from-loop
-            (output, state) = call_cell()
-            
-            outputs.append(output)
-            input_ = output
+        # the previous output is the next input
+        step = lambda time, prev_output, _, state: cell(prev_output, state)
+        outputs, state = _unroll_conv2d(step, sequence_length, single_input, state, None,
+                                        recompute_interval, varscope)
 
         return (outputs, state)
 
     
 def rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, sampling_prob, is_training, initial_state=None,
-                                  dtype=tf.float32, scope=None):
+                                  dtype=tf.float32, per_example=False, recompute_interval=None, scope=None):
     """Creates a recurrent neural network specified by RNNConv2DCell `cell`, that has only
        a single input, and reuses the last output as its new input.
     Args:
@@ -234,7 +236,8 @@ def rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, samplin
         is_training: Boolean (or bool-Tensor)
             Indicates whether we are in training mode or inference mode. During trainng, scheduled 
             sampling s performed. In inference mode (False), no scheduled sampling is used and we
-            use "Always sampling" instead.
+            use "Always sampling" instead. When it is the constant False, the GT inputs are not
+            used at all.
         initial_state: (optional) An initial state for the RNN.
             If `cell.state_size` is an integer, this must be
             a tensor of appropriate type and shape `[batch_size x cell.state_size]`.
@@ -242,6 +245,14 @@ def rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, samplin
             tensors having shapes `[batch_size, s] for s in cell.state_size`.
         dtype: (optional) The data type for the initial state.  Required if
             initial_state is not provided.
+        per_example: (optional) Whether the coin is flipped for each example of the batch,
+                     and the inputs are blended using the resulting mask, instead of flipping
+                     a single coin per timestep to switch the whole batch using tf.cond.
+        recompute_interval: (optional) The number of timesteps of which only the state of
+                            the first is kept for the backward pass, while the activations of
+                            all others are recomputed. Use None to keep all activations.
+                            The cell must only use trainable variables within the RNN scope,
+                            because no gradients flow to others (ValueError otherwise).
         scope: VariableScope for the created subgraph; defaults to "RNNConv2D".
     Returns:
         A pair (outputs, state) where:
@@ -259,7 +270,6 @@ def rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, samplin
     if prev_repr_input is None:
         raise ValueError("prev_repr_input must not be empty")
 
-    outputs = []
     # Create a new scope in which the caching device is either
     # determined by the parent scope, or is set to place the cached
     # Variable using the same placement as for the rest of the RNN.
@@ -289,35 +299,563 @@ def rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, samplin
                                  "dtype must be specified")
             state = cell.zero_state(batch_size, dtype)
 
-        input_ = prev_repr_input
-        for time in xrange(len(gt_repr_inputs)):
+        if is_training is False:
+            # always sampling, without any control flow
+            step = lambda time, prev_output, _, state: cell(prev_output, state)
+            step_inputs = None
+        else:
+            # flip the coins outside of the steps, to not draw them again on recomputation
+            sample_decisions = [_scheduled_sampling_decision(batch_size, sampling_prob, is_training,
+                                                             per_example, prev_repr_input.dtype)
+                                for _ in xrange(len(gt_repr_inputs))]
+            
+            def step(time, prev_output, step_input, state):
+                gt_repr_input, sample_decision = step_input
+                cell_input = _scheduled_sampling_select(sample_decision, gt_repr_input, prev_output)
+                return cell(cell_input, state)
+            step_inputs = zip(gt_repr_inputs, sample_decisions)
+        
+        outputs, state = _unroll_conv2d(step, len(gt_repr_inputs), prev_repr_input, state,
+                                        step_inputs, recompute_interval, varscope)
+
+        return (outputs, state)
+
+    
+    
+def _scheduled_sampling_decision(batch_size, sampling_prob, is_training, per_example, dtype):
+    """Flips the coin(s) whether to take the GT input in a single timestep.
+    Returns:
+        A bool-scalar for a single coin flip, or a mask of shape [batch_size, 1, 1, 1]
+        with 1.0 for each example that takes the GT input.
+    """
+    with tf.name_scope("scheduled_sampling"):
+        coin_shape = [batch_size] if per_example else []
+        uniform_random = tf.random_uniform(coin_shape, 0, 1.0, dtype=tf.float32)
+        coin_success = tf.less(uniform_random, sampling_prob, name="coin_flip")
+        
+        # combine both decisions with logical switch, because nested tf.cond caused an error
+        sample_from_gt = coin_success if is_training is True \
+            else tf.logical_and(is_training, coin_success)
+        
+        if per_example:
+            return tf.reshape(tf.cast(sample_from_gt, dtype), [-1, 1, 1, 1])
+        return sample_from_gt
+
+
+def _scheduled_sampling_select(sample_decision, gt_repr_input, prev_output):
+    """Selects the input of a timestep, either by switching using a single decision, or by
+       blending the GT input and the previous output per example using a mask."""
+    with tf.name_scope("scheduled_sampling"):
+        if sample_decision.dtype == tf.bool:
+            return tf.cond(sample_decision,
+                           lambda: gt_repr_input,
+                           lambda: prev_output,
+                           name="sample_switch")
+        return sample_decision * gt_repr_input + (1.0 - sample_decision) * prev_output
+
+
+def _unroll_conv2d(step, num_steps, initial_output, state, step_inputs,
+                   recompute_interval, varscope):
+    """Statically unrolls the steps of a RNN. Optionally, the steps are grouped to
+       segments, of which only the inputs and the initial state are kept for the backward
+       pass, while all activations within the segment are recomputed.
+    Args:
+        step: function(time, prev_output, step_input, state) that returns a pair
+              (output, state) of the step.
+        num_steps: The number of steps.
+        initial_output: The tensor that is passed as previous output to the first step,
+                        or None.
+        state: The initial state.
+        step_inputs: A length T list of (nested) tensors that are passed to each step, or None.
+        recompute_interval: The number of steps of each recomputed segment, or None.
+        varscope: The VariableScope of the RNN, that reuses the variables after the first step.
+    Returns:
+        A pair (outputs, state) of the length T outputs list and the final state.
+    """
+    outputs = []
+    prev_output = initial_output
+    
+    if recompute_interval is None:
+        for time in xrange(num_steps):
             if time > 0:
                 varscope.reuse_variables()
-            
-            with tf.name_scope("scheduled_sampling"):
-                uniform_random = tf.random_uniform([], 0, 1.0, dtype=tf.float32)
-                coin_success = tf.less(uniform_random, sampling_prob, name="coin_flip")
-                
-                # combine both decisions with logical switch, because nested tf.cond caused an error
-                sample_from_gt = tf.logical_and(is_training, coin_success)
-                
-                cell_input = tf.cond(sample_from_gt,
-                                     lambda: gt_repr_inputs[time],
-                                     lambda: input_,
-                                     name="sample_switch")
-            
-            # pylint: disable=cell-var-from-loop
-            call_cell = lambda: cell(cell_input, state)
-            # pylint: enable=cell-var-from-loop
-            (output, state) = call_cell()
+            step_input = step_inputs[time] if step_inputs is not None else None
+            output, state = step(time, prev_output, step_input, state)
+            outputs.append(output)
+            prev_output = output
+        return (outputs, state)
+    
+    assert recompute_interval > 0, "The recompute interval has to be positive."
+    
+    for start in xrange(0, num_steps, recompute_interval):
+        stop = min(start + recompute_interval, num_steps)
+        segment_inputs = step_inputs[start:stop] if step_inputs is not None else None
+        
+        segment = _recomputed_segment(step, start, stop, prev_output is not None,
+                                      state, segment_inputs, varscope)
+        args = [prev_output] if prev_output is not None else []
+        args += nest.flatten(state) + nest.flatten(segment_inputs or [])
+        results = segment(*args)
+        
+        segment_outputs = list(results[:(stop - start)])
+        state = nest.pack_sequence_as(state, list(results[(stop - start):]))
+        outputs.extend(segment_outputs)
+        prev_output = segment_outputs[-1]
+        
+        # the variables have been created by the first segment
+        varscope.reuse_variables()
+    
+    return (outputs, state)
+
 
-            input_ = output
+def _recomputed_segment(step, start, stop, has_prev_output, state_structure, inputs_structure,
+                        varscope):
+    """Creates the function of a segment of steps on flat tensor arguments, whose
+       activations are recomputed in the backward pass."""
+    num_state = len(nest.flatten(state_structure))
+    
+    def segment(*args):
+        args = list(args)
+        prev_output = args.pop(0) if has_prev_output else None
+        state = nest.pack_sequence_as(state_structure, args[:num_state])
+        segment_inputs = nest.pack_sequence_as(inputs_structure, args[num_state:]) \
+            if inputs_structure is not None else None
+        
+        outputs = []
+        for time in xrange(start, stop):
+            if time > 0:
+                tf.get_variable_scope().reuse_variables()
+            step_input = segment_inputs[time - start] if segment_inputs is not None else None
+            output, state = step(time, prev_output, step_input, state)
             outputs.append(output)
+            prev_output = output
+        return tuple(outputs + nest.flatten(state))
+    
+    def recomputed_segment(*args):
+        return _recompute_grad(segment, list(args), varscope)
+    
+    return recomputed_segment
+
+
+_RECOMPUTE_IDS = itertools.count()
+
+_VARIABLE_OP_TYPES = ('Variable', 'VariableV2', 'VarHandleOp')
+
+
+def _check_recomputed_variables(outputs, segment_ops, variables):
+    """Ensures that a recomputed segment only reads trainable variables whose gradients
+       are recomputed. All others would silently get no gradient, because the gradient
+       path through the forward pass is cut.
+    Args:
+        outputs: The list of output tensors of the segment.
+        segment_ops: The set of operations that have been created by the segment.
+        variables: The list of variables whose gradients are recomputed.
+    Raises:
+        ValueError: In case the segment reads any other trainable variable.
+    """
+    trainable_ops = set(v.op for v in tf.trainable_variables())
+    recomputed_ops = set(v.op for v in variables)
+    missing = set()
+    
+    visited = set()
+    stack = [t.op for t in outputs]
+    while stack:
+        op = stack.pop()
+        if op in visited:
+            continue
+        visited.add(op)
+        
+        var_op = None
+        if op.type in _VARIABLE_OP_TYPES:
+            var_op = op
+        elif op.type == 'Identity' and len(op.inputs) == 1 and \
+             op.inputs[0].op.type in _VARIABLE_OP_TYPES:
+            # the snapshot of a variable, e.g. 'weights/read'
+            var_op = op.inputs[0].op
+        
+        if var_op is not None:
+            if var_op in trainable_ops and var_op not in recomputed_ops:
+                missing.add(var_op.name)
+        elif op in segment_ops:
+            stack.extend(t.op for t in op.inputs)
+    
+    if len(missing) > 0:
+        raise ValueError("Recomputed RNN segments can only use trainable variables within the "
+                         "RNN scope, but also use: {}".format(", ".join(sorted(missing))))
+
+
+def _recompute_grad(fn, inputs, varscope):
+    """Calls a function, whose activations are not kept for the backward pass. The outputs
+       are passed through an identity function with a custom gradient, which recomputes the
+       activations from the inputs as soon as the gradients of the outputs are available.
+    Args:
+        fn: function(*inputs) that returns a tuple of tensors.
+        inputs: The list of input tensors.
+        varscope: The VariableScope of the RNN, which contains all variables used by `fn`.
+    Returns:
+        The list of output tensors.
+    """
+    graph = tf.get_default_graph()
+    num_ops = len(graph.get_operations())
+    outputs = list(fn(*inputs))
+    segment_ops = set(graph.get_operations()[num_ops:])
+    
+    variables = [v for v in tf.trainable_variables()
+                 if v.op.name.startswith(varscope.name + "/")]
+    _check_recomputed_variables(outputs, segment_ops, variables)
+    num_inputs = len(inputs)
+    num_vars = len(variables)
+    
+    def grad_func(op, *output_grads):
+        output_grads = [g if g is not None else tf.zeros_like(o)
+                        for g, o in zip(output_grads, outputs)]
+        # delay the recomputation until it is required by the backward pass
+        with tf.control_dependencies(output_grads):
+            fn_inputs = [tf.identity(x) for x in op.inputs[:num_inputs]]
+        
+        update_ops = tf.get_collection_ref(tf.GraphKeys.UPDATE_OPS)
+        num_update_ops = len(update_ops)
+        with tf.variable_scope(varscope, reuse=True):
+            fn_outputs = list(fn(*fn_inputs))
+        # the recomputation must not update e.g. the batch-norm statistics a second time
+        del update_ops[num_update_ops:]
+        
+        grads = tf.gradients(fn_outputs, fn_inputs + variables, grad_ys=output_grads)
+        # no gradient flows through the activations of the forward pass
+        return tuple(grads + [None] * len(outputs))
+    
+    @function.Defun(*[t.dtype.base_dtype for t in inputs + variables + outputs],
+                    func_name="RecomputeSegment_{}".format(next(_RECOMPUTE_IDS)),
+                    python_grad_func=grad_func)
+    def identity(*args):
+        return tuple([tf.identity(t) for t in args[(num_inputs + num_vars):]])
+    
+    results = identity(*(inputs + [v.value() for v in variables] + outputs))
+    if not isinstance(results, (list, tuple)):
+        results = [results]
+    results = list(results)
+    for result, output in zip(results, outputs):
+        result.set_shape(output.get_shape())
+    return results
+
+
+def dynamic_rnn_conv2d(cell, inputs, initial_state=None, dtype=tf.float32,
+                       sequence_length=None, parallel_iterations=32, swap_memory=False, scope=None):
+    """Creates a recurrent neural network specified by RNNConv2DCell `cell`, equal to
+       rnn_conv2d(), but using a symbolic loop (tf.while_loop) instead of unrolling the
+       sequence. The graph size and construction time is therefore independent of the
+       sequence length. The variables are named equal to rnn_conv2d().
+       The cell has to be usable within a loop, e.g. batch normalization requires
+       'updates_collections=None'.
+    Args:
+        cell: An instance of RNNConv2DCell.
+        inputs: A length T list of inputs, each a tensor of shape
+            [batch_size, height, width, channels], or a time-major tensor of shape
+            [T, batch_size, height, width, channels].
+        initial_state: (optional) An initial state for the RNN.
+        dtype: (optional) The data type for the initial state.  Required if
+            initial_state is not provided.
+        sequence_length: Specifies the length of each sequence in inputs.
+                         An int32 or int64 vector (tensor) size `[batch_size]`, values in `[0, T)`.
+                         The outputs past the length are zero and the state is kept.
+        parallel_iterations: (optional) The number of iterations allowed to run in parallel.
+        swap_memory: (optional) Whether the tensors of the forward pass are swapped from
+                     the GPU to the host memory, to fit long sequences in GPU memory.
+        scope: VariableScope for the created subgraph; defaults to "RNN".
+    Returns:
+        A pair (outputs, state) where:
+        - outputs is a length T list of outputs in case the inputs are a list,
+          or a time-major tensor otherwise
+        - state is the final state
+    Raises:
+        TypeError: If `cell` is not an instance of RNNConv2DCell.
+        ValueError: If `inputs` is `None` or an empty list.
+    """
+    if not isinstance(cell, RNNConv2DCell):
+        raise TypeError("cell must be an instance of RNNConv2DCell")
+    if inputs is None or (isinstance(inputs, list) and not inputs):
+        raise ValueError("inputs must not be empty")
+    
+    inputs_is_list = isinstance(inputs, list)
+    if inputs_is_list:
+        # the stacked outputs of the while-loop have no static length
+        num_inputs = len(inputs)
+        inputs = tf.stack(inputs)
+    
+    with vs.variable_scope(scope or "RNN") as varscope:
+        if varscope.caching_device is None:
+            varscope.set_caching_device(lambda op: op.device)
+        
+        num_steps = tf.shape(inputs)[0]
+        state, zero_output = _dynamic_rnn_conv2d_init(cell, inputs[0], initial_state, dtype)
+        
+        input_ta = tf.TensorArray(inputs.dtype, size=num_steps).unstack(inputs)
+        outputs, state = _dynamic_rnn_conv2d_loop(cell, num_steps, zero_output, state,
+                                                  lambda time, prev_output: input_ta.read(time),
+                                                  sequence_length, parallel_iterations, swap_memory)
+    
+    if inputs_is_list:
+        outputs = tf.unstack(outputs, num=num_inputs)
+    return (outputs, state)
 
-        return (outputs, state)
 
+def dynamic_rnn_conv2d_roundabout(cell, single_input, sequence_length, initial_state=None,
+                                  dtype=tf.float32, parallel_iterations=32, swap_memory=False, scope=None):
+    """Creates a recurrent neural network specified by RNNConv2DCell `cell`, that has only
+       a single input, and reuses the last output as its new input. Equal to
+       rnn_conv2d_roundabout(), but using a symbolic loop (tf.while_loop).
+    Args:
+        cell: An instance of RNNConv2DCell.
+        single_input: A singe input tensor of shape [batch_size, height, width, channels].
+        sequence_length: Specifies the length of the RNN, as int or scalar int32-tensor.
+        initial_state: (optional) An initial state for the RNN.
+        dtype: (optional) The data type for the initial state.  Required if
+            initial_state is not provided.
+        parallel_iterations: (optional) The number of iterations allowed to run in parallel.
+        swap_memory: (optional) Whether the tensors of the forward pass are swapped from
+                     the GPU to the host memory, to fit long sequences in GPU memory.
+        scope: VariableScope for the created subgraph; defaults to "RNN".
+    Returns:
+        A pair (outputs, state) where:
+        - outputs is a length T list of outputs in case the sequence length is an int,
+          or a time-major tensor otherwise
+        - state is the final state
+    Raises:
+        TypeError: If `cell` is not an instance of RNNConv2DCell.
+        ValueError: If `single_input` is `None` or a list.
+    """
+    if not isinstance(cell, RNNConv2DCell):
+        raise TypeError("cell must be an instance of RNNC2DCell")
+    if isinstance(single_input, list):
+        raise TypeError("single_input must be no list")
+    if single_input is None:
+        raise ValueError("single_input must not be empty")
     
+    with vs.variable_scope(scope or "RNN") as varscope:
+        if varscope.caching_device is None:
+            varscope.set_caching_device(lambda op: op.device)
+        
+        state, _ = _dynamic_rnn_conv2d_init(cell, single_input, initial_state, dtype)
+        outputs, state = _dynamic_rnn_conv2d_loop(cell, sequence_length, single_input, state,
+                                                  lambda time, prev_output: prev_output,
+                                                  None, parallel_iterations, swap_memory)
     
+    if isinstance(sequence_length, int):
+        outputs = tf.unstack(outputs, num=sequence_length)
+    return (outputs, state)
+
+
+def dynamic_rnn_conv2d_scheduled_sampling(cell, prev_repr_input, gt_repr_inputs, sampling_prob, is_training,
+                                          initial_state=None, dtype=tf.float32, per_example=False,
+                                          parallel_iterations=32, swap_memory=False, scope=None):
+    """Creates a recurrent neural network specified by RNNConv2DCell `cell`, that uses scheduled
+       sampling to select either the GT input or the previous output as the next input. Equal to
+       rnn_conv2d_scheduled_sampling(), but using a symbolic loop (tf.while_loop).
+    Args:
+        cell: An instance of RNNConv2DCell.
+        prev_repr_input: Tensor
+            The representation as the first input.
+        gt_repr_inputs: list(Tensor) or Tensor
+            All GT represetation input tensors of shape [batch_size, ...], or a time-major
+            tensor of these.
+        sampling_prob: float
+            The probablilty of taking the GT frame as input for the next timestep, evaluated at every
+            timestep.
+        is_training: Boolean (or bool-Tensor)
+            Indicates whether we are in training mode or inference mode. In inference mode (False),
+            no scheduled sampling is used and we use "Always sampling" instead.
+        initial_state: (optional) An initial state for the RNN.
+        dtype: (optional) The data type for the initial state.  Required if
+            initial_state is not provided.
+        per_example: (optional) Whether the coin is flipped for each example of the batch,
+                     instead of a single coin per timestep for the whole batch.
+        parallel_iterations: (optional) The number of iterations allowed to run in parallel.
+        swap_memory: (optional) Whether the tensors of the forward pass are swapped from
+                     the GPU to the host memory, to fit long sequences in GPU memory.
+        scope: VariableScope for the created subgraph; defaults to "RNN".
+    Returns:
+        A pair (outputs, state) where:
+        - outputs is a length T list of outputs in case the GT inputs are a list,
+          or a time-major tensor otherwise
+        - state is the final state
+    Raises:
+        TypeError: If `cell` is not an instance of RNNConv2DCell.
+        ValueError: If `prev_repr_input` is `None` or a list.
+    """
+    if not isinstance(cell, RNNConv2DCell):
+        raise TypeError("cell must be an instance of RNNC2DCell")
+    if isinstance(prev_repr_input, list):
+        raise TypeError("prev_repr_input must be no list")
+    if prev_repr_input is None:
+        raise ValueError("prev_repr_input must not be empty")
+    
+    gt_is_list = isinstance(gt_repr_inputs, list)
+    if gt_is_list:
+        # the stacked outputs of the while-loop have no static length
+        num_gt_inputs = len(gt_repr_inputs)
+        gt_repr_inputs = tf.stack(gt_repr_inputs)
+    
+    with vs.variable_scope(scope or "RNN") as varscope:
+        if varscope.caching_device is None:
+            varscope.set_caching_device(lambda op: op.device)
+        
+        num_steps = tf.shape(gt_repr_inputs)[0]
+        state, _ = _dynamic_rnn_conv2d_init(cell, prev_repr_input, initial_state, dtype)
+        gt_ta = tf.TensorArray(gt_repr_inputs.dtype, size=num_steps).unstack(gt_repr_inputs)
+        batch_size = tf.shape(prev_repr_input)[0]
+        
+        def select_input(time, prev_output):
+            if is_training is False:
+                return prev_output
+            sample_decision = _scheduled_sampling_decision(batch_size, sampling_prob, is_training,
+                                                           per_example, prev_output.dtype)
+            return _scheduled_sampling_select(sample_decision, gt_ta.read(time), prev_output)
+        
+        outputs, state = _dynamic_rnn_conv2d_loop(cell, num_steps, prev_repr_input, state,
+                                                  select_input, None, parallel_iterations, swap_memory)
+    
+    if gt_is_list:
+        outputs = tf.unstack(outputs, num=num_gt_inputs)
+    return (outputs, state)
+
+
+def _dynamic_rnn_conv2d_init(cell, first_input, initial_state, dtype):
+    """Gets the initial state and a zero output of the cell for the batch of the first input."""
+    fixed_batch_size = first_input.get_shape().with_rank(4)[0]
+    if fixed_batch_size.value:
+        batch_size = fixed_batch_size.value
+    else:
+        batch_size = tf.shape(first_input)[0]
+    
+    if initial_state is not None:
+        state = initial_state
+    else:
+        if not dtype:
+            raise ValueError("If no initial_state is provided, "
+                             "dtype must be specified")
+        state = cell.zero_state(batch_size, dtype)
+    
+    zero_output = tf.zeros(tf.stack([batch_size] + list(cell.output_size)), first_input.dtype)
+    zero_output.set_shape([fixed_batch_size.value] + list(cell.output_size))
+    return state, zero_output
+
+
+def _dynamic_rnn_conv2d_loop(cell, num_steps, initial_output, initial_state, select_input,
+                             sequence_length, parallel_iterations, swap_memory):
+    """Runs the cell within a tf.while_loop.
+    Args:
+        cell: An instance of RNNConv2DCell.
+        num_steps: The number of steps, as int or scalar int32-tensor.
+        initial_output: The output that is passed as previous output to the first step.
+        initial_state: The initial state of the cell.
+        select_input: function(time, prev_output) that returns the input of the cell.
+        sequence_length: int32-vector of the length of each sequence, or None.
+        parallel_iterations: The number of iterations allowed to run in parallel.
+        swap_memory: Whether to swap the forward pass tensors to the host memory.
+    Returns:
+        A pair (outputs, state) of the time-major outputs tensor and the final state.
+    """
+    if sequence_length is not None:
+        sequence_length = tf.to_int32(sequence_length)
+    
+    def body(time, prev_output, state, output_ta):
+        output, new_state = cell(select_input(time, prev_output), state)
+        
+        if sequence_length is not None:
+            # zero the outputs and keep the states of the finished sequences
+            mask = tf.reshape(tf.cast(tf.less(time, sequence_length), output.dtype), [-1, 1, 1, 1])
+            output = output * mask
+            new_state = nest.pack_sequence_as(
+                structure=state,
+                flat_sequence=[mask * new + (1.0 - mask) * old
+                               for new, old in zip(nest.flatten(new_state), nest.flatten(state))])
+        
+        output_ta = output_ta.write(time, output)
+        return (time + 1, output, new_state, output_ta)
+    
+    time = tf.constant(0, dtype=tf.int32, name="time")
+    output_ta = tf.TensorArray(initial_output.dtype, size=num_steps)
+    _, _, final_state, output_ta = tf.while_loop(
+        cond=lambda time, *_: tf.less(time, num_steps),
+        body=body,
+        loop_vars=(time, initial_output, initial_state, output_ta),
+        parallel_iterations=parallel_iterations,
+        swap_memory=swap_memory)
+    
+    return output_ta.stack(), final_state
+
+
+# gates of the convolutional LSTM cells that can be fused, in the order of the fused kernel
+FUSED_GATES = [("xi", "xj", "xf", "xo"),
+               ("hi", "hj", "hf", "ho"),
+               ("i", "j", "f", "o"),
+               ("i", "f")]
+
+
+def convert_lstm_conv2d_checkpoint(checkpoint_path, output_path, fused_gates=True):
+    """Converts the variables of the convolutional LSTM cells of a checkpoint between
+       the split layout (one convolution per gate) and the fused layout ('fused_gates=True').
+       Slot variables of the optimizer and EMA variables are converted as well.
+       All other variables are copied unchanged.
+    Parameters
+    ----------
+    checkpoint_path: str
+        The path of the checkpoint to convert.
+    output_path: str
+        The path of the converted checkpoint.
+    fused_gates: Boolean, optional
+        Whether to convert to the fused layout (default) or back to the split layout.
+    Returns
+    ----------
+    The number of converted gate groups.
+    """
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    values = {name: reader.get_tensor(name)
+              for name in reader.get_variable_to_shape_map()}
+    
+    # the gate variables are named '.../Conv_{x,h,peep}/<gate>/{W,b}[/<slot>]'
+    pattern = re.compile(r"^(.*/Conv_(?:x|h|peep)/)([^/]+)/(W|b)(/.*)?$")
+    groups = collections.defaultdict(dict)
+    for name in values:
+        match = pattern.match(name)
+        if match is not None:
+            prefix, gate, param, suffix = match.groups()
+            groups[(prefix, param, suffix or "")][gate] = name
+    
+    converted = {}
+    num_converted = 0
+    for (prefix, param, suffix), gates in groups.iteritems():
+        if fused_gates:
+            # greedy, because the input peepholes ('i', 'f') are a subset of the gates
+            for gate_names in FUSED_GATES:
+                if all(gate in gates for gate in gate_names):
+                    parts = [values.pop(gates.pop(gate)) for gate in gate_names]
+                    fused_name = "{}{}/{}{}".format(prefix, "_".join(gate_names), param, suffix)
+                    converted[fused_name] = np.concatenate(parts, axis=-1)
+                    num_converted += 1
+        else:
+            for gate, name in gates.iteritems():
+                gate_names = tuple(gate.split("_"))
+                if gate_names in FUSED_GATES:
+                    parts = np.split(values.pop(name), len(gate_names), axis=-1)
+                    for gate_name, part in zip(gate_names, parts):
+                        split_name = "{}{}/{}{}".format(prefix, gate_name, param, suffix)
+                        converted[split_name] = part
+                    num_converted += 1
+    values.update(converted)
+    
+    with tf.Graph().as_default():
+        var_list = [tf.Variable(value, name=name) for name, value in values.iteritems()]
+        saver = tf.train.Saver(var_list=var_list)
+        with tf.Session() as sess:
+            sess.run(tf.variables_initializer(var_list))
+            saver.save(sess, output_path, write_meta_graph=False)
+    
+    print("Converted {} gate groups to the {} layout.".format(num_converted,
+                                                               "fused" if fused_gates else "split"))
+    return num_converted
+
+
 def _sequence_like(instance, args):
     """Checks and returns sequence like structure.
     Taken from TensorFlow v0.9.
@@ -442,7 +980,7 @@ class BasicLSTMConv2DCell(RNNConv2DCell):
                  hidden_weight_init=light.init.orthogonal_initializer(),
                  forget_bias=1.0,
                  activation=tf.nn.tanh, hidden_activation=tf.nn.sigmoid,
-                 device=None):
+                 fused_gates=False, device=None):
         """Initialize the basic 2D convolutional LSTM cell.
         Parameters
         ----------
@@ -471,6 +1009,11 @@ class BasicLSTMConv2DCell(RNNConv2DCell):
             Activation function of the output and cell states.
         hidden_activation: function
             Activation function of the hidden states.
+        fused_gates: Boolean, optional
+            Whether all gates are computed by a single convolution of the inputs and a single
+            convolution of the hidden state, which are split afterwards. This reduces the number
+            of kernel launches per step. The variables are not compatible to the unfused cell,
+            use 'convert_lstm_conv2d_checkpoint()' to convert existing checkpoints.
         device: str or None, optional
             The device to which memory the variables will get stored on. (e.g. '/cpu:0')
         """
@@ -485,6 +1028,7 @@ class BasicLSTMConv2DCell(RNNConv2DCell):
         self._state_is_tuple = True
         self._activation = activation
         self._hidden_activation = hidden_activation
+        self._fused_gates = fused_gates
         self._device = device
 
     @property
@@ -501,48 +1045,62 @@ class BasicLSTMConv2DCell(RNNConv2DCell):
         """2D convolutional Long short-term memory cell (LSTMConv2D)."""
         with vs.variable_scope(scope or "BasicLSTM2DCell"):
             c, h = state
-            with tf.variable_scope("Conv_x"):
-                conv_xi = light.network.conv2d("xi", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
-                conv_xj = light.network.conv2d("xj", inputs,self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
-                conv_xf = light.network.conv2d("xf", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=self._forget_bias,
-                                            device=self._device)
-                conv_xo = light.network.conv2d("xo", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
-            with tf.variable_scope("Conv_h"):
-                conv_hi = light.network.conv2d("hi", h, self._n_filters, 
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
-                conv_hj = light.network.conv2d("hj", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
-                conv_hf = light.network.conv2d("hf", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
-                conv_ho = light.network.conv2d("ho", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
+            if self._fused_gates:
+                with tf.variable_scope("Conv_x"):
+                    conv_xi, conv_xj, conv_xf, conv_xo = _fused_conv2d(
+                        inputs, ("xi", "xj", "xf", "xo"), self._n_filters, self._ksize_input,
+                        weight_init=self._weight_init,
+                        bias_inits=[0.0, 0.0, self._forget_bias, 0.0],
+                        device=self._device)
+                with tf.variable_scope("Conv_h"):
+                    conv_hi, conv_hj, conv_hf, conv_ho = _fused_conv2d(
+                        h, ("hi", "hj", "hf", "ho"), self._n_filters, self._ksize_hidden,
+                        weight_init=self._hidden_weight_init,
+                        bias_inits=None,
+                        device=self._device)
+            else:
+                with tf.variable_scope("Conv_x"):
+                    conv_xi = light.network.conv2d("xi", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
+                    conv_xj = light.network.conv2d("xj", inputs,self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
+                    conv_xf = light.network.conv2d("xf", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=self._forget_bias,
+                                                device=self._device)
+                    conv_xo = light.network.conv2d("xo", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
+                with tf.variable_scope("Conv_h"):
+                    conv_hi = light.network.conv2d("hi", h, self._n_filters, 
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
+                    conv_hj = light.network.conv2d("hj", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
+                    conv_hf = light.network.conv2d("hf", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
+                    conv_ho = light.network.conv2d("ho", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
 
             i = conv_xi + conv_hi  # input gate
             j = conv_xj + conv_hj  # new input
@@ -588,7 +1146,7 @@ class LSTMConv2DCell(RNNConv2DCell):
                  hidden_weight_init=light.init.orthogonal_initializer(),
                  forget_bias=1.0,
                  activation=tf.nn.tanh, hidden_activation=tf.nn.sigmoid,
-                 device=None):
+                 fused_gates=False, device=None):
         """Initialize the basic 2D convolutional LSTM cell.
         Parameters
         ----------
@@ -640,6 +1198,11 @@ class LSTMConv2DCell(RNNConv2DCell):
             Activation function of the output and cell states.
         hidden_activation: function
             Activation function of the hidden states.
+        fused_gates: Boolean, optional
+            Whether all gates are computed by a single convolution of the inputs and a single
+            convolution of the hidden state, which are split afterwards. This reduces the number
+            of kernel launches per step. The variables are not compatible to the unfused cell,
+            use 'convert_lstm_conv2d_checkpoint()' to convert existing checkpoints.
         device: str or None, optional
             The device to which memory the variables will get stored on. (e.g. '/cpu:0')
         """
@@ -661,6 +1224,7 @@ class LSTMConv2DCell(RNNConv2DCell):
         self._state_is_tuple = True
         self._activation = activation
         self._hidden_activation = hidden_activation
+        self._fused_gates = fused_gates
         self._device = device
         
         self._use_peepholes = use_peepholes
@@ -671,6 +1235,14 @@ class LSTMConv2DCell(RNNConv2DCell):
         self._updates_collections = updates_collections
         self._is_training = is_training
 
+    def _batch_norm_gates(self, gates, scope):
+        """Applies a shared batch normalization to each of the gates separately,
+           equal to the unfused cell."""
+        return [tf.contrib.layers.batch_norm(gate, scale=True,
+            center=False, updates_collections=self._updates_collections,
+            is_training=self._is_training, reuse=True if g > 0 else None, scope=scope)
+                for g, gate in enumerate(gates)]
+
     @property
     def state_size(self):
         return tf.nn.rnn_cell.LSTMStateTuple(
@@ -685,125 +1257,153 @@ class LSTMConv2DCell(RNNConv2DCell):
         """2D convolutional Long short-term memory cell (LSTMConv2D)."""
         with vs.variable_scope(scope or "LSTMC2DCell"):
             c, h = state
-            with tf.variable_scope("Conv_x") as varscope:
-                conv_xi = light.network.conv2d("i", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
+            if self._fused_gates:
+                with tf.variable_scope("Conv_x"):
+                    conv_x = _fused_conv2d(inputs, ("i", "j", "f", "o"), self._n_filters, self._ksize_input,
+                                           weight_init=self._weight_init,
+                                           bias_inits=[0.0, 0.0, self._forget_bias, 0.0],
+                                           device=self._device)
+                    if self._bn_input_hidden:
+                        conv_x = self._batch_norm_gates(conv_x, "bn_x")
+                    conv_xi, conv_xj, conv_xf, conv_xo = conv_x
+
+                with tf.variable_scope("Conv_h"):
+                    conv_h = _fused_conv2d(h, ("i", "j", "f", "o"), self._n_filters, self._ksize_hidden,
+                                           weight_init=self._hidden_weight_init,
+                                           bias_inits=None,
+                                           device=self._device)
+                    if self._bn_input_hidden:
+                        conv_h = self._batch_norm_gates(conv_h, "bn_h")
+                    conv_hi, conv_hj, conv_hf, conv_ho = conv_h
+            else:
+                with tf.variable_scope("Conv_x") as varscope:
+                    conv_xi = light.network.conv2d("i", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_xi = tf.contrib.layers.batch_norm(conv_xi, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, scope="bn_x")
+                    if self._bn_input_hidden:
+                        conv_xi = tf.contrib.layers.batch_norm(conv_xi, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, scope="bn_x")
                 
-                conv_xj = light.network.conv2d("j", inputs,self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
+                    conv_xj = light.network.conv2d("j", inputs,self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_xj = tf.contrib.layers.batch_norm(conv_xj, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_x")
+                    if self._bn_input_hidden:
+                        conv_xj = tf.contrib.layers.batch_norm(conv_xj, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_x")
                 
-                conv_xf = light.network.conv2d("f", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=self._forget_bias,
-                                            device=self._device)
+                    conv_xf = light.network.conv2d("f", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=self._forget_bias,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_xf = tf.contrib.layers.batch_norm(conv_xf, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_x")
+                    if self._bn_input_hidden:
+                        conv_xf = tf.contrib.layers.batch_norm(conv_xf, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_x")
                 
-                conv_xo = light.network.conv2d("o", inputs, self._n_filters,
-                                            self._ksize_input, (1, 1),
-                                            weight_init=self._weight_init,
-                                            bias_init=0.0,
-                                            device=self._device)
+                    conv_xo = light.network.conv2d("o", inputs, self._n_filters,
+                                                self._ksize_input, (1, 1),
+                                                weight_init=self._weight_init,
+                                                bias_init=0.0,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_xo = tf.contrib.layers.batch_norm(conv_xo, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_x")
+                    if self._bn_input_hidden:
+                        conv_xo = tf.contrib.layers.batch_norm(conv_xo, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_x")
 
-            with tf.variable_scope("Conv_h") as varscope:
-                conv_hi = light.network.conv2d("i", h, self._n_filters, 
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
+                with tf.variable_scope("Conv_h") as varscope:
+                    conv_hi = light.network.conv2d("i", h, self._n_filters, 
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_hi = tf.contrib.layers.batch_norm(conv_hi, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, scope="bn_h")
+                    if self._bn_input_hidden:
+                        conv_hi = tf.contrib.layers.batch_norm(conv_hi, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, scope="bn_h")
                 
-                conv_hj = light.network.conv2d("j", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
+                    conv_hj = light.network.conv2d("j", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_hj = tf.contrib.layers.batch_norm(conv_hj, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_h")
+                    if self._bn_input_hidden:
+                        conv_hj = tf.contrib.layers.batch_norm(conv_hj, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_h")
                 
-                conv_hf = light.network.conv2d("f", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
+                    conv_hf = light.network.conv2d("f", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_hf = tf.contrib.layers.batch_norm(conv_hf, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_h")
+                    if self._bn_input_hidden:
+                        conv_hf = tf.contrib.layers.batch_norm(conv_hf, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_h")
                 
-                conv_ho = light.network.conv2d("o", h, self._n_filters,
-                                            self._ksize_hidden, (1, 1),
-                                            weight_init=self._hidden_weight_init,
-                                            bias_init=None,
-                                            device=self._device)
+                    conv_ho = light.network.conv2d("o", h, self._n_filters,
+                                                self._ksize_hidden, (1, 1),
+                                                weight_init=self._hidden_weight_init,
+                                                bias_init=None,
+                                                device=self._device)
                 
-                if self._bn_input_hidden:
-                    conv_ho = tf.contrib.layers.batch_norm(conv_ho, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, reuse=True, scope="bn_h")
+                    if self._bn_input_hidden:
+                        conv_ho = tf.contrib.layers.batch_norm(conv_ho, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, reuse=True, scope="bn_h")
 
-                i = conv_xi + conv_hi  # input gate
-                j = conv_xj + conv_hj  # new input
-                f = conv_xf + conv_hf  # forget gate
-                o = conv_xo + conv_ho  # output gate
+            i = conv_xi + conv_hi  # input gate
+            j = conv_xj + conv_hj  # new input
+            f = conv_xf + conv_hf  # forget gate
+            o = conv_xo + conv_ho  # output gate
             
             if self._use_peepholes:
                 # peepholes for input
                 with tf.variable_scope("Conv_peep"):
-                    conv_ci = light.network.conv2d("i", c, self._n_filters, 
-                                                self._ksize_hidden, (1, 1),
-                                                weight_init=self._weight_init,
-                                                bias_init=None,
-                                                device=self._device)
+                    if self._fused_gates:
+                        conv_c = _fused_conv2d(c, ("i", "f"), self._n_filters, self._ksize_hidden,
+                                               weight_init=self._weight_init,
+                                               bias_inits=None,
+                                               device=self._device)
+                        if self._bn_peepholes:
+                            conv_c = self._batch_norm_gates(conv_c, "bn_peep")
+                        conv_ci, conv_cf = conv_c
+                    else:
+                        conv_ci = light.network.conv2d("i", c, self._n_filters, 
+                                                    self._ksize_hidden, (1, 1),
+                                                    weight_init=self._weight_init,
+                                                    bias_init=None,
+                                                    device=self._device)
                     
-                    if self._bn_peepholes:
-                        conv_ci = tf.contrib.layers.batch_norm(conv_ci, scale=True,
-                        center=False, updates_collections=self._updates_collections,
-                        is_training=self._is_training, scope="bn_peep")
+                        if self._bn_peepholes:
+                            conv_ci = tf.contrib.layers.batch_norm(conv_ci, scale=True,
+                            center=False, updates_collections=self._updates_collections,
+                            is_training=self._is_training, scope="bn_peep")
                     
-                    conv_cf = light.network.conv2d("f", c, self._n_filters,
-                                                self._ksize_hidden, (1, 1),
-                                                weight_init=self._weight_init,
-                                                bias_init=None,
-                                                device=self._device)
+                        conv_cf = light.network.conv2d("f", c, self._n_filters,
+                                                    self._ksize_hidden, (1, 1),
+                                                    weight_init=self._weight_init,
+                                                    bias_init=None,
+                                                    device=self._device)
                     
-                    if self._bn_peepholes:
-                        conv_cf = tf.contrib.layers.batch_norm(conv_cf, scale=True,
-                            center=False, updates_collections=self._updates_collections,
-                            is_training=self._is_training, reuse=True, scope="bn_peep")
+                        if self._bn_peepholes:
+                            conv_cf = tf.contrib.layers.batch_norm(conv_cf, scale=True,
+                                center=False, updates_collections=self._updates_collections,
+                                is_training=self._is_training, reuse=True, scope="bn_peep")
                     
                     i += conv_ci
                     f += conv_cf
@@ -1372,4 +1972,51 @@ def _linear(args, output_size, bias, bias_start=0.0, scope=None, device=None):
             initializer=tf.constant_initializer(
                 bias_start, dtype=dtype),
             device=device)
-    return res + bias_term
\ No newline at end of file
+    return res + bias_term
+
+
+def _fused_conv2d(x, gate_names, n_filters, ksize, weight_init, bias_inits, device=None):
+    """Computes the convolutions of multiple gates at once, using a single kernel
+       with n_filters per gate that is split into the gates afterwards. The gate slices
+       are initialized independently, equal to separate convolutions.
+    Parameters
+    ----------
+    x: Tensor
+        The input tensor to convolve.
+    gate_names: tuple(str)
+        The names of the gates, which are joined to the variable scope name.
+    n_filters: int
+        The number of filters of each gate.
+    ksize: tuple or list of (int, int)
+        The number of (rows, columns) of the convolutional kernel.
+    weight_init: float or function
+        Initialization's of the weights of each gate.
+    bias_inits: list(float) or None
+        The constant bias initialization of each gate, or None to not use a bias.
+    device: str or None, optional
+        The device to which memory the variables will get stored on. (e.g. '/cpu:0')
+    Returns
+    ----------
+    A list of the gate tensors, in the order of the gate names.
+    """
+    num_gates = len(gate_names)
+    
+    if isinstance(weight_init, types.FunctionType):
+        gate_weight_init = weight_init
+        def weight_init(shape, dtype=tf.float32, partition_info=None):
+            gate_shape = [int(dim) for dim in shape[:-1]] + [int(shape[-1]) // num_gates]
+            return tf.concat(len(gate_shape) - 1, [gate_weight_init(gate_shape, dtype=dtype)
+                                                   for _ in range(num_gates)])
+    
+    bias_init = None
+    if bias_inits is not None:
+        def bias_init(shape, dtype=tf.float32, partition_info=None):
+            values = np.repeat(np.asarray(bias_inits, dtype=np.float32), n_filters)
+            return tf.constant(values, dtype=dtype)
+    
+    conv = light.network.conv2d("_".join(gate_names), x, num_gates * n_filters,
+                                ksize, (1, 1),
+                                weight_init=weight_init,
+                                bias_init=bias_init,
+                                device=device)
+    return tf.split(3, num_gates, conv)
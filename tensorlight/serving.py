@@ -0,0 +1,290 @@
+from __future__ import print_function
+
+import os
+import json
+
+import numpy as np
+import tensorflow as tf
+import tensorlight as light
+
+
+SIGNATURE_POSTFIX = ".signature.json"
+LATEST_CHECKPOINT = 'LATEST'
+
+
+def write_signature(path, inputs, output, is_training=None, feeds={}):
+    """Writes the signature of an exported inference graph, which describes
+       the tensor names that are required to run the inference.
+    Parameters
+    ----------
+    path: str
+        The file path of the exported graph.
+    inputs: str
+        The name of the inputs tensor.
+    output: str
+        The name of the inference tensor.
+    is_training: str or None, optional
+        The name of the is-training tensor, in case it is used by the inference.
+    feeds: dict(str, str), optional
+        The names of the model specific feeds tensors that are used by the inference.
+    """
+    signature = {"inputs": inputs,
+                 "output": output,
+                 "is_training": is_training,
+                 "feeds": feeds}
+    with open(path + SIGNATURE_POSTFIX, 'w') as f:
+        json.dump(signature, f, indent=2, sort_keys=True)
+
+
+def read_signature(path):
+    """Reads the signature of an exported inference graph.
+    Parameters
+    ----------
+    path: str
+        The file path of the exported graph.
+    Returns
+    ----------
+    The signature as a dictionary.
+    """
+    with open(path + SIGNATURE_POSTFIX, 'r') as f:
+        return json.load(f)
+
+
+class FrozenInference(object):
+    """Runs a frozen inference graph that has been exported by a runtime
+       using 'export_inference()'. It does not require the model code."""
+
+    def __init__(self, path, gpu_allow_growth=True, gpu_memory_fraction=1.0):
+        """Loads the frozen inference graph.
+        Parameters
+        ----------
+        path: str
+            The file path of the exported graph.
+        gpu_allow_growth: Boolean, optional
+            Whether the GPUS is allowed to allocate memory dynamically.
+        gpu_memory_fraction: float in range (0, 1], optional
+            The fraction of the (currently available) memory it is allows to reserve.
+        """
+        if not os.path.isfile(path):
+            raise ValueError("Exported graph not found: {}".format(path))
+
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self._signature = read_signature(path)
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self._inputs = self._graph.get_tensor_by_name(self._signature["inputs"])
+        self._output = self._graph.get_tensor_by_name(self._signature["output"])
+        self._feeds = {key: self._graph.get_tensor_by_name(name)
+                       for key, name in self._signature["feeds"].iteritems()}
+
+        gpu_options = tf.GPUOptions(
+            per_process_gpu_memory_fraction=gpu_memory_fraction,
+            allow_growth=gpu_allow_growth)
+        self._session = tf.Session(graph=self._graph,
+                                   config=tf.ConfigProto(gpu_options=gpu_options))
+
+    def predict(self, inputs, feeds={}):
+        """Performs a prediction using the frozen model.
+        Parameters
+        ----------
+        inputs: numpy n-D array
+            The inputs to the model to do the inference.
+        feeds: dict(str, value), optional
+            The values of the model specific feeds that are used by the inference.
+        Returns
+        ---------
+        The predictions of the model as an numpy n-D array.
+        """
+        feed = {self._inputs: inputs}
+        for key, value in feeds.iteritems():
+            if key in self._feeds:
+                feed.update({self._feeds[key]: value})
+        return self._session.run(self._output, feed_dict=feed)
+
+    def close(self):
+        """Closes the session and releases its resources."""
+        self._session.close()
+
+    @property
+    def graph(self):
+        """Gets the graph."""
+        return self._graph
+
+    @property
+    def signature(self):
+        """Gets the signature of the exported graph as a dictionary."""
+        return self._signature
+
+
+class InferenceRuntime(object):
+    """Lightweight runtime for predictions only. In contrast to the training runtimes,
+       it builds the inference graph of the model only, without the input pipeline,
+       the optimizer, the losses and the summaries, and restores the weights directly
+       from a checkpoint of the training directory."""
+
+    def __init__(self, train_dir, model, input_shape, target_shape=None,
+                 restore_checkpoint=LATEST_CHECKPOINT, restore_ema_variables=True,
+                 restore_model_params=False, warmup_batch_sizes=None, warmup_feeds={}, gpu_devices=None,
+                 gpu_allow_growth=True, gpu_memory_fraction=1.0):
+        """Creates the inference runtime and restores the model.
+        Parameters
+        ----------
+        train_dir: str
+            The training directory that contains the checkpoints.
+        model: light.model.AbstractModel
+            The model to build the inference for.
+        input_shape: list(int)
+            The shape (excluding batch-size!) of the inputs.
+        target_shape: list(int) or None, optional
+            The shape (excluding batch-size!) of the inference. Use None in case
+            of an autoencoder, where the target shape equals the input shape.
+        restore_checkpoint: str or int, optional
+            The filename of the checkpoint file or step-number within 'train_dir' to restore.
+            Use 'LATEST' or 'light.core.LATEST_CHECKPOINT' to restore the lastest file.
+        restore_ema_variables: Boolean, optional
+            Whether the exponential moving averages of the trainable variables (default)
+            or their raw values should be restored.
+        restore_model_params: Boolean, optional
+            Whether to restore the model parameters from the training directory. This will override
+            all parameters of the model object.
+        warmup_batch_sizes: list(int) or None, optional
+            The batch sizes to run a prediction with right after restoring, so that the
+            device memory allocation and algorithm selection is not part of the first request.
+        warmup_feeds: dict(str, value), optional
+            The values of the model specific feeds used for the warm-up predictions.
+        gpu_devices: list(int) or None, optional
+            The list of the used GPU device IDs. Only the first device is used.
+        gpu_allow_growth: Boolean, optional
+            Whether the GPUS is allowed to allocate memory dynamically.
+        gpu_memory_fraction: float in range (0, 1], optional
+            The fraction of the (currently available) memory it is allows to reserve.
+        """
+        assert gpu_memory_fraction > 0 and gpu_memory_fraction <= 1, "GPU memory fraction has to be in range (0,1]."
+
+        if gpu_devices is not None and len(gpu_devices) > 1:
+            # only select the first one
+            gpu_devices = gpu_devices[:1]
+        light.hardware.set_cuda_devices(gpu_devices)
+
+        if target_shape is None:
+            target_shape = input_shape
+
+        self._train_dir = train_dir
+        self._model = model
+
+        if restore_model_params:
+            print("Restoring model parameters...")
+            self._model.load(os.path.join(train_dir, light.core.MODEL_PARAMS_FILE))
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            # use the same names as the training runtime, to be able to restore its checkpoints
+            global_step = tf.get_variable('global_step', shape=[], dtype=tf.int32, trainable=False,
+                                          initializer=tf.zeros_initializer())
+            self._inputs = tf.placeholder(tf.float32, [None] + input_shape, "X")
+            with tf.name_scope("default_targets"):
+                targets = tf.zeros(tf.stack([tf.shape(self._inputs)[0]] + target_shape))
+            self._feeds = self._model.fetch_feeds()
+            self._model.install(global_step)
+
+            with tf.name_scope("inference"):
+                inference = self._model.inference(self._inputs, targets,
+                                                  feeds=self._feeds,
+                                                  is_training=False,
+                                                  device_scope=None, memory_device=None)
+                self._inference = tf.reshape(inference, [-1] + target_shape, name="ensure_shape")
+
+            if restore_ema_variables:
+                variable_averages = tf.train.ExponentialMovingAverage(0.9999, global_step)
+                restore_vars = variable_averages.variables_to_restore()
+            else:
+                restore_vars = tf.global_variables()
+            saver = tf.train.Saver(var_list=restore_vars)
+
+            gpu_options = tf.GPUOptions(
+                per_process_gpu_memory_fraction=gpu_memory_fraction,
+                allow_growth=gpu_allow_growth)
+            self._session = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options))
+
+            if restore_checkpoint == LATEST_CHECKPOINT:
+                checkpoint_path = tf.train.latest_checkpoint(train_dir)
+                assert checkpoint_path is not None, "No latest checkpoint file found."
+            elif isinstance(restore_checkpoint, int):
+                checkpoint_path = os.path.join(train_dir,
+                                               "{}-{}".format(light.core.CHECKPOINT_FILE, restore_checkpoint))
+            else:
+                checkpoint_path = os.path.join(train_dir, restore_checkpoint)
+
+            print("Restoring {}variables from: {}".format("EMA " if restore_ema_variables else "",
+                                                          checkpoint_path))
+            saver.restore(self._session, checkpoint_path)
+
+        if warmup_batch_sizes is not None:
+            for batch_size in warmup_batch_sizes:
+                self.predict(np.zeros([batch_size] + input_shape, np.float32), warmup_feeds)
+
+    def predict(self, inputs, feeds={}):
+        """Performs a prediction using the restored model.
+        Parameters
+        ----------
+        inputs: numpy n-D array
+            The inputs to the model to do the inference.
+        feeds: dict(str, value), optional
+            The values of the model specific feeds, that have been
+            defined in AbstractModel.fetch_feeds().
+        Returns
+        ---------
+        The predictions of the model as an numpy n-D array.
+        """
+        feed = {self._inputs: inputs}
+        for key, value in feeds.iteritems():
+            feed.update({self._feeds[key]: value})
+        return self._session.run(self._inference, feed_dict=feed)
+
+    def predict_batched(self, inputs, batch_size, feeds={}):
+        """Performs a prediction by splitting the inputs into chunks of the given batch size.
+        Parameters
+        ----------
+        inputs: numpy n-D array
+            The inputs to the model to do the inference.
+        batch_size: int
+            The batch size of each chunk.
+        feeds: dict(str, value), optional
+            The values of the model specific feeds, that have been
+            defined in AbstractModel.fetch_feeds().
+        Returns
+        ---------
+        The predictions of the model as an numpy n-D array.
+        """
+        count = inputs.shape[0]
+        predictions = None
+        for start in xrange(0, count, batch_size):
+            chunk = self.predict(inputs[start:(start + batch_size)], feeds)
+            if predictions is None:
+                predictions = np.empty([count] + list(chunk.shape[1:]), dtype=chunk.dtype)
+            predictions[start:(start + chunk.shape[0])] = chunk
+        return predictions
+
+    def close(self):
+        """Closes the session and releases its resources."""
+        self._session.close()
+
+    @property
+    def graph(self):
+        """Gets the graph."""
+        return self._graph
+
+    @property
+    def session(self):
+        """Gets the session."""
+        return self._session
+
+    @property
+    def train_dir(self):
+        """Gets the training directory."""
+        return self._train_dir
@@ -1,6 +1,7 @@
 import sys
 import os
 import types
+import threading
 import jsonpickle
 import collections
 
@@ -15,6 +16,8 @@ ADAGRAD = 'adagrad'
 MOMENTUM = 'momentum'
 NESTEROV = 'nesterov'
 
+DYNAMIC_LOSS_SCALE = 'dynamic'
+
 
 class Optimizer(object):
     """Optimizer class to encapsulate (all) optimizers from its creation.
@@ -93,13 +96,17 @@ class Optimizer(object):
                        "decay": decay,
                        "momentum": momentum}
         
-    def build(self, global_step):
+    def build(self, global_step, loss_scale=None):
         """Actually builds the optimizer including the learning rate decay
            if it was configured.
         Parameters
         ----------
         global_step: int or tf.Variable
             The global step counter.
+        loss_scale: float or str or None, optional
+            The loss scaling for mixed precision training, either a static scale,
+            or 'DYNAMIC_LOSS_SCALE' to adjust the scale automatically. The optimizer
+            is wrapped by a 'LossScaleOptimizer' in this case. Use None to not scale the loss.
         Returns
         ----------
         Tuple (optimizer, learning_rate) of the created optimizer.
@@ -146,6 +153,9 @@ class Optimizer(object):
                                              use_nesterov=True)
         else:
             raise ValueError("Unknown optimizer. Contributors welcome...")
+        
+        if loss_scale is not None:
+            opt = LossScaleOptimizer(opt, loss_scale)
         return opt, lr
     
     def save(self, filepath):
@@ -219,6 +229,228 @@ class Optimizer(object):
 
 
 
+class LossScaleOptimizer(object):
+    """Optimizer wrapper for mixed precision training, that scales the loss before the
+       gradients are computed, to prevent the float16 gradients from underflowing, and
+       unscales the gradients afterwards.
+       In case of a dynamic loss scale, the scale is halved and the update is skipped
+       when any gradient is not finite, so that the variables as well as the state of the
+       wrapped optimizer remain untouched. The scale is doubled after a number of finite steps.
+       The global step is incremented in any case.
+       The scale is tracked in local variables, so that checkpoints remain compatible with
+       training runs without loss scaling.
+    """
+    def __init__(self, optimizer, loss_scale, initial_dynamic_scale=2.0**15,
+                 increment_steps=2000, factor=2.0):
+        """Creates a loss scaling optimizer.
+        Parameters
+        ----------
+        optimizer: tf.train.Optimizer
+            The optimizer to wrap.
+        loss_scale: float or str
+            The static loss scale, or 'DYNAMIC_LOSS_SCALE'.
+        initial_dynamic_scale: float, optional
+            The initial scale in case of dynamic loss scaling.
+        increment_steps: int, optional
+            The number of steps with finite gradients, after which the dynamic scale is increased.
+        factor: float, optional
+            The factor to increase or decrease the dynamic scale.
+        """
+        self._opt = optimizer
+        self._dynamic = loss_scale == DYNAMIC_LOSS_SCALE
+        self._increment_steps = increment_steps
+        self._factor = factor
+        
+        if self._dynamic:
+            self._loss_scale = tf.get_variable("loss_scale", shape=[], dtype=tf.float32, trainable=False,
+                                               initializer=tf.constant_initializer(initial_dynamic_scale),
+                                               collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            self._finite_steps = tf.get_variable("loss_scale_finite_steps", shape=[], dtype=tf.int32,
+                                                 trainable=False, initializer=tf.zeros_initializer(),
+                                                 collections=[tf.GraphKeys.LOCAL_VARIABLES])
+        else:
+            assert loss_scale > 0, "Loss scale must be positive."
+            self._loss_scale = tf.constant(float(loss_scale), name="loss_scale")
+            self._finite_steps = None
+    
+    def compute_gradients(self, loss, var_list=None, **kwargs):
+        """Computes the unscaled gradients of the scaled loss."""
+        grads = self._opt.compute_gradients(loss * self._loss_scale, var_list=var_list, **kwargs)
+        return [(None if g is None else g / self._loss_scale, v) for g, v in grads]
+    
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+        """Applies the gradients, which are skipped in case of a dynamic loss scale
+           and any non-finite gradient."""
+        if not self._dynamic:
+            return self._opt.apply_gradients(grads_and_vars, global_step=global_step, name=name)
+        
+        grads_and_vars = list(grads_and_vars)
+        with tf.name_scope("loss_scale"):
+            def values(g):
+                return g.values if isinstance(g, tf.IndexedSlices) else g
+            
+            all_finite = tf.reduce_all(tf.stack([tf.reduce_all(tf.is_finite(values(g)))
+                                                 for g, _ in grads_and_vars if g is not None]))
+        
+        # create the slots (and e.g. Adam's beta-power accumulators) outside of the
+        # conditional update, because variables cannot be created within a control
+        # flow context. The update within the cond reuses them.
+        with tf.control_dependencies(None):
+            self._opt._create_slots([v for g, v in grads_and_vars if g is not None])
+        
+        with tf.name_scope("loss_scale"):
+            def increase_scale():
+                return tf.group(tf.assign(self._loss_scale, self._loss_scale * self._factor),
+                                tf.assign(self._finite_steps, 0))
+            
+            def count_finite_step():
+                return tf.group(tf.assign_add(self._finite_steps, 1))
+            
+            def decrease_scale():
+                return tf.group(tf.assign(self._loss_scale,
+                                          tf.maximum(self._loss_scale / self._factor, 1.0)),
+                                tf.assign(self._finite_steps, 0))
+            
+            def on_finite():
+                apply_op = self._opt.apply_gradients(grads_and_vars, name=name)
+                with tf.control_dependencies([apply_op]):
+                    return tf.cond(self._finite_steps + 1 >= self._increment_steps,
+                                   increase_scale, count_finite_step)
+            
+            update_op = tf.cond(all_finite, on_finite, decrease_scale)
+        
+        if global_step is None:
+            return update_op
+        with tf.control_dependencies([update_op]):
+            return tf.assign_add(global_step, 1).op
+    
+    def __getattr__(self, name):
+        # delegate everything else, such as get_slot(), to the wrapped optimizer
+        return getattr(self._opt, name)
+    
+    @property
+    def loss_scale(self):
+        """Gets the current loss scale tensor."""
+        return self._loss_scale
+
+
+class AsyncCheckpointSaver(object):
+    """Checkpoint saver that writes the checkpoints in a background thread.
+       The variable values are snapshotted to host memory with a single fetch,
+       and are then written using a separate graph and session, so that the
+       training does not have to wait for the serialization and file writes.
+       Note: No meta graph files are written.
+    """
+    def __init__(self, var_list, max_to_keep=5):
+        """Creates an asynchronous checkpoint saver.
+        Parameters
+        ----------
+        var_list: dict(str, tf.Variable) or list(tf.Variable)
+            The variables to save, either as a dict that maps the checkpoint names
+            to the variables, or as a list to use the variable names.
+        max_to_keep: int, optional
+            The number of last checkpoints to keep. Use 0 or None to keep all checkpoints.
+        """
+        if not isinstance(var_list, dict):
+            var_list = {var.op.name: var for var in var_list}
+        
+        names = sorted(var_list.keys())
+        self._variables = [var_list[name] for name in names]
+        
+        # mirror the variables in a separate graph, which are initialized by feeding
+        # the snapshotted values before each save
+        self._graph = tf.Graph()
+        with self._graph.as_default(), tf.device('/cpu:0'):
+            self._placeholders = []
+            save_dict = {}
+            for i, (name, var) in enumerate(zip(names, self._variables)):
+                ph = tf.placeholder(var.dtype.base_dtype, var.get_shape())
+                save_dict[name] = tf.Variable(ph, trainable=False, collections=[],
+                                              name="var_{}".format(i))
+                self._placeholders.append(ph)
+            self._init_op = tf.group(*[v.initializer for v in save_dict.values()])
+            self._saver = tf.train.Saver(var_list=save_dict, max_to_keep=max_to_keep)
+        self._session = tf.Session(graph=self._graph,
+                                   config=tf.ConfigProto(device_count={'GPU': 0}))
+        
+        self._thread = None
+        self._error = None
+        
+    def _write(self, values, save_path, global_step):
+        """Writes the snapshotted values. Runs in the background thread."""
+        try:
+            feed = dict(zip(self._placeholders, values))
+            self._session.run(self._init_op, feed_dict=feed)
+            # continue the checkpoint history of previous runs or synchronous saves
+            recover_checkpoint_history(self._saver, os.path.dirname(save_path))
+            self._saver.save(self._session, save_path, global_step=global_step,
+                             write_meta_graph=False)
+        except Exception as e:
+            self._error = e
+        
+    def save(self, session, save_path, global_step):
+        """Snapshots the variables and writes the checkpoint in the background.
+           In case the previous checkpoint is still written, this waits until it
+           is finished.
+        Parameters
+        ----------
+        session: tf.Session
+            The session of the variables to save.
+        save_path: str
+            The path prefix of the checkpoint files.
+        global_step: int
+            The global step that is appended to the checkpoint filename.
+        """
+        self.wait()
+        
+        values = session.run(self._variables)
+        self._thread = threading.Thread(target=self._write,
+                                        args=(values, save_path, global_step))
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def wait(self):
+        """Waits until the current checkpoint has been written, and raises
+           the error of the write in case it failed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+    
+    def close(self):
+        """Waits for the current checkpoint and releases the resources."""
+        try:
+            self.wait()
+        finally:
+            self._session.close()
+    
+    @property
+    def in_progress(self):
+        """Indicates whether a checkpoint is currently written."""
+        return self._thread is not None and self._thread.is_alive()
+
+
+def recover_checkpoint_history(saver, checkpoint_dir):
+    """Seeds the saver with the checkpoints listed in the checkpoint state file of the
+       directory, so that it deletes the oldest of these according to its 'max_to_keep'
+       and keeps them in the state file it writes. Without it, a saver only knows its
+       own saves, e.g. when a training is resumed or multiple savers are used.
+    Parameters
+    ----------
+    saver: tf.train.Saver
+        The saver that writes the next checkpoint.
+    checkpoint_dir: str
+        The directory of the checkpoint state file.
+    """
+    state = tf.train.get_checkpoint_state(checkpoint_dir)
+    if state is not None:
+        saver.recover_last_checkpoints(state.all_model_checkpoint_paths)
+
+
 def average_gradients(tower_grads):
     """Calculate the average gradient for each shared variable across all towers
     in a mulit-GPU environment.
@@ -258,7 +490,52 @@ def average_gradients(tower_grads):
             grad_and_var = (grad, v)
             average_grads.append(grad_and_var)
         return average_grads
-    
+
+
+def accumulate_gradients(grads_and_vars, accumulate_steps):
+    """Creates non-trainable buffers to accumulate the gradients over multiple micro-batches,
+       so that a larger effective batch size can be trained than fits into the device memory.
+    Parameters
+    ----------
+    grads_and_vars: List of pairs of (gradient, variable)
+        The gradients of a single micro-batch.
+    accumulate_steps: int
+        The number of micro-batches to accumulate per applied update.
+    Returns
+    ----------
+    accumulate_op: Operation
+        The operation that adds the current gradients to the buffers. It has to be
+        run for all but the last micro-batch of an update.
+    mean_grads_and_vars: List of pairs of (gradient, variable)
+        The averaged gradients of all micro-batches, including the current one, which
+        can be passed to apply_gradients() for the last micro-batch of an update.
+    accumulators: list(Variable)
+        The buffer variables, which have to be reset after the update has been applied.
+    """
+    assert accumulate_steps > 1, "Gradient accumulation requires at least two steps."
+
+    with tf.name_scope("accumulate_grads"):
+        accumulate_ops = []
+        mean_grads_and_vars = []
+        accumulators = []
+        for g, v in grads_and_vars:
+            if g is None:
+                mean_grads_and_vars.append((g, v))
+                continue
+
+            # local variables are neither saved in checkpoints nor averaged by EMA
+            accumulator = tf.Variable(tf.zeros(v.get_shape(), dtype=v.dtype.base_dtype),
+                                      trainable=False,
+                                      collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                      name=v.op.name + "/accumulator")
+            g = tf.convert_to_tensor(g)
+            accumulate_ops.append(tf.assign_add(accumulator, g))
+            mean_grad = tf.assign_add(accumulator, g) / accumulate_steps
+            mean_grads_and_vars.append((mean_grad, v))
+            accumulators.append(accumulator)
+        accumulate_op = tf.group(*accumulate_ops, name="accumulate_op")
+    return accumulate_op, mean_grads_and_vars, accumulators
+
 
 def inverse_sigmoid_decay(initial_value, global_step, decay_rate=1000.0,
                           name=None):
@@ -1,6 +1,9 @@
+import lazy
 import attr
-import data
-import image
 import path
 import ui
-import video
\ No newline at end of file
+
+# modules with heavy dependencies are imported on first access
+data = lazy.LazyModule(__name__ + ".data")
+image = lazy.LazyModule(__name__ + ".image")
+video = lazy.LazyModule(__name__ + ".video")
@@ -2,7 +2,12 @@ import os
 import sys
 import rarfile
 import tarfile
+import json
+import time
+import hashlib
 import zipfile
+import collections
+import multiprocessing
 from six.moves import urllib
 
 import numpy as np
@@ -17,6 +22,17 @@ SUBDIR_TRAIN = '_train'
 SUBDIR_VALID = '_valid'
 SUBDIR_TEST = '_test'
 
+# postfix of the per-video manifest files of preprocess_videos()
+MANIFEST_POSTFIX = ".manifest.json"
+
+# index file and commit interval (in videos) of the sharded sequence format
+SHARD_INDEX_FILENAME = "shards.index.json"
+SHARD_COMMIT_INTERVAL = 64
+
+# postfix of the file next to the serialization directory that lists all
+# sequences after a complete preprocessing run
+SUMMARY_POSTFIX = ".index.json"
+
 
 def download(url, target_dir):
     """Downloads a file from a given URL to the specified directory while indicating
@@ -111,10 +127,364 @@ def as_binary(array):
     return np.around(array)
 
 
+class SequenceFileReader(object):
+    """Random access reader for serialized frame sequence files, as created by
+       preprocess_videos(). The files are memory-mapped, so that only the frames that
+       are actually accessed are read from disk. The opened files are kept in a
+       LRU cache to reduce the costs to open and close them on every read.
+    """
+    def __init__(self, frame_shape, dtype=np.uint8, max_open_files=64):
+        """Creates a sequence file reader.
+        Parameters
+        ----------
+        frame_shape: int list or tuple of shape [h, w, c]
+            The shape of a single serialized frame.
+        dtype: type, optional
+            The numpy type of the serialized data.
+        max_open_files: int, optional
+            The maximum number of memory-mapped files to keep open.
+        """
+        assert max_open_files > 0, "At least one file has to be kept open."
+        
+        self._frame_shape = tuple(frame_shape)
+        self._dtype = np.dtype(dtype)
+        self._frame_bytes = int(np.prod(self._frame_shape)) * self._dtype.itemsize
+        self._max_open_files = max_open_files
+        self._cache = collections.OrderedDict()
+        
+    def _get_frames(self, filepath):
+        """Gets the memory-mapped frames of a file from the cache, or opens it."""
+        frames = self._cache.pop(filepath, None)
+        if frames is None:
+            frames_count = os.path.getsize(filepath) // self._frame_bytes
+            frames = np.memmap(filepath, dtype=self._dtype, mode='r',
+                               shape=(frames_count,) + self._frame_shape)
+            if len(self._cache) >= self._max_open_files:
+                # remove the least recently used file
+                self._cache.popitem(last=False)
+        self._cache[filepath] = frames
+        return frames
+        
+    def read(self, filepath, start_frame, count, offset=0):
+        """Reads consecutive frames of a serialized sequence file.
+        Parameters
+        ----------
+        filepath: str
+            The path to the serialized sequence file or shard file.
+        start_frame: int
+            The index of the first frame to read, relative to the offset.
+        count: int
+            The number of frames to read.
+        offset: int, optional
+            The position of the sequence in the file in bytes, which is used to
+            read a sequence from a shard file.
+        Returns
+        ----------
+        A read-only array view of shape [count, h, w, c]. The data is only read
+        from disk when it is accessed.
+        """
+        assert offset % self._frame_bytes == 0, "Offset has to be a multiple of the frame size."
+        
+        frames = self._get_frames(filepath)
+        start_frame += offset // self._frame_bytes
+        assert start_frame >= 0 and start_frame + count <= frames.shape[0], \
+            "Frame range exceeds the sequence length of {}.".format(filepath)
+        return frames[start_frame:(start_frame + count)]
+    
+    def clear(self):
+        """Closes all cached files."""
+        self._cache.clear()
+    
+    @property
+    def open_files(self):
+        """Gets the number of currently opened files."""
+        return len(self._cache)
+
+
+def _read_manifest(filepath):
+    """Reads a video manifest file, or returns None if it does not exist or is broken."""
+    if not os.path.isfile(filepath):
+        return None
+    try:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def _write_manifest(filepath, manifest):
+    """Writes a video manifest file atomically, so that an interrupted write
+       never leaves a valid manifest behind."""
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp_filepath, filepath)
+
+
+def _decode_clips(video_path, target_size, serialized_sequence_length, gray_scale, scale_factor):
+    """Decodes a video into non-overlapping clips of equal length.
+       An incomplete clip at the end of the video is dismissed.
+    Returns
+    ----------
+    A generator of ndarrays with shape [serialized_sequence_length, h, w, c].
+    """
+    with tt.utils.video.VideoReader(video_path, streaming=True) as vr:
+        # until we reach the end of the video
+        while True:
+            frames = []
+            if vr.frames_left >= serialized_sequence_length:
+                for f in xrange(serialized_sequence_length):
+                    frame = vr.next_frame(scale_factor)
+
+                    if frame is None:
+                        break
+                    
+                    # ensure bounds
+                    frame = tt.utils.image.pad_or_crop(frame, target_size, pad_value=0.0,
+                                                       ensure_copy=False)
+                    
+                    # convert to gray if requried
+                    if gray_scale:
+                        frame = tt.utils.image.to_grayscale(frame)
+                        
+                    frames.append(frame)
+
+            if len(frames) < serialized_sequence_length:
+                break
+            
+            yield np.asarray(frames)
+
+
+def _serialize_video(args):
+    """Serializes the frame sequences of a single video and writes its manifest.
+       This is the worker function of preprocess_videos().
+    Returns
+    ----------
+    A tuple (clip_filenames, frames_count, error) of the serialized video.
+    """
+    video_path, full_path, manifest, target_size, serialized_sequence_length, \
+        gray_scale, scale_factor = args
+    
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    clips = []
+    frames_count = 0
+    try:
+        for clip in _decode_clips(video_path, target_size, serialized_sequence_length,
+                                  gray_scale, scale_factor):
+            filename_seq = "{}-{}.seq".format(video_name, len(clips))
+            tt.utils.image.write_as_binary(os.path.join(full_path, filename_seq), clip)
+            clips.append(filename_seq)
+            frames_count += clip.shape[0]
+    except Exception as e:
+        return None, frames_count, "{}: {}".format(video_path, e)
+    
+    # the manifest is written last, which marks the video as completely serialized
+    manifest["clips"] = clips
+    _write_manifest(os.path.join(full_path, video_name + MANIFEST_POSTFIX), manifest)
+    return clips, frames_count, None
+
+
+def _decode_video(args):
+    """Decodes the frame sequences of a single video, which are written to the shards
+       by the main process. This is the worker function of preprocess_videos().
+    Returns
+    ----------
+    A tuple (clips, frames_count, error) of the decoded video.
+    """
+    video_path, target_size, serialized_sequence_length, gray_scale, scale_factor = args
+    
+    clips = []
+    frames_count = 0
+    try:
+        for clip in _decode_clips(video_path, target_size, serialized_sequence_length,
+                                  gray_scale, scale_factor):
+            clips.append(clip)
+            frames_count += clip.shape[0]
+    except Exception as e:
+        return None, frames_count, "{}: {}".format(video_path, e)
+    return clips, frames_count, None
+
+
+class _ShardWriter(object):
+    """Appends fixed-length clip records to large shard files and maintains the
+       shard index, which maps each video to the (shard, offset) of its clips.
+       Records that are not covered by the last committed index are truncated
+       when an interrupted preprocessing is resumed, and records that are not
+       referenced anymore are removed by compact().
+    """
+    def __init__(self, full_path, params, shard_size):
+        """Opens the shard index of the given directory, or creates a new one in case
+           the index does not exist or has been created using different params.
+        Parameters
+        ----------
+        full_path: str
+            The directory of the shard files.
+        params: dict
+            The preprocessing params the shards are created with.
+        shard_size: int
+            The maximum size of a shard file in bytes.
+        """
+        self._full_path = full_path
+        self._shard_size = shard_size
+        self._index_path = os.path.join(full_path, SHARD_INDEX_FILENAME)
+        self._file = None
+        self._uncommitted = 0
+        # the clips are serialized as uint8
+        self._record_bytes = int(np.prod(params["frame_shape"])) * params["serialized_sequence_length"]
+        
+        index = _read_manifest(self._index_path)
+        if index is None or index.get("params") != params or not self._truncate_shards(index):
+            index = {"params": params, "generation": 0, "shards": [], "videos": {}}
+        self._index = index
+        
+    def _truncate_shards(self, index):
+        """Cuts off the uncommitted records of all shards.
+        Returns
+        ----------
+        False in case a shard file is missing or incomplete, else True.
+        """
+        for shard in index["shards"]:
+            shard_path = os.path.join(self._full_path, shard["name"])
+            if not os.path.isfile(shard_path) or os.path.getsize(shard_path) < shard["size"]:
+                return False
+        for shard in index["shards"]:
+            shard_path = os.path.join(self._full_path, shard["name"])
+            if os.path.getsize(shard_path) > shard["size"]:
+                with open(shard_path, 'r+b') as f:
+                    f.truncate(shard["size"])
+        return True
+    
+    def _open_shard(self, record_bytes):
+        """Opens the shard file to append the next record to."""
+        shards = self._index["shards"]
+        if self._file is None and len(shards) > 0 and \
+           shards[-1]["size"] + record_bytes <= self._shard_size:
+            # continue the last shard of a previous run
+            self._file = open(os.path.join(self._full_path, shards[-1]["name"]), 'ab')
+        elif self._file is None or (shards[-1]["size"] > 0 and
+                                    shards[-1]["size"] + record_bytes > self._shard_size):
+            if self._file is not None:
+                self._file.close()
+            shard = {"name": "shard-{:03d}-{:05d}.bin".format(self._index.get("generation", 0),
+                                                              len(shards)),
+                     "size": 0}
+            shards.append(shard)
+            self._file = open(os.path.join(self._full_path, shard["name"]), 'wb')
+    
+    def get(self, video_name):
+        """Gets the index entry of a video, or None if it is not serialized."""
+        return self._index["videos"].get(video_name)
+    
+    def append(self, video_name, entry, clips):
+        """Appends the clips of a video to the shards.
+        Parameters
+        ----------
+        video_name: str
+            The name of the video.
+        entry: dict
+            The video properties to store in the index.
+        clips: list(ndarray)
+            The clips of the video, all of equal shape.
+        """
+        self._append_records(video_name, entry, [clip.tobytes() for clip in clips])
+        
+        self._uncommitted += 1
+        if self._uncommitted >= SHARD_COMMIT_INTERVAL:
+            self.commit()
+    
+    def _append_records(self, video_name, entry, records_bytes):
+        """Appends the serialized clips of a video to the shards, without committing the index."""
+        records = []
+        for clip_bytes in records_bytes:
+            self._open_shard(len(clip_bytes))
+            shard = self._index["shards"][-1]
+            records.append([len(self._index["shards"]) - 1, shard["size"]])
+            self._file.write(clip_bytes)
+            shard["size"] += len(clip_bytes)
+        
+        entry = dict(entry)
+        entry["clips"] = records
+        self._index["videos"][video_name] = entry
+    
+    def compact(self, video_names):
+        """Rewrites the shards to contain the records of the given videos only, in case these
+           contain any other records, such as the records of videos that have been serialized
+           again on resume, or of videos that are not part of the dataset anymore. Otherwise,
+           a reader that streams the whole shard files would read these records as well.
+           The previous shards are deleted after the new index has been committed.
+        Parameters
+        ----------
+        video_names: list(str)
+            The names of the videos to keep, in the order their records are written.
+        """
+        self.close()
+        
+        videos = self._index["videos"]
+        used_bytes = sum(len(videos[name]["clips"]) for name in video_names) * self._record_bytes
+        total_bytes = sum(shard["size"] for shard in self._index["shards"])
+        if len(videos) == len(video_names) and used_bytes == total_bytes:
+            return
+        
+        print("Compacting shards from {} to {} bytes...".format(total_bytes, used_bytes))
+        old_paths = self.shard_paths
+        old_files = {}
+        self._index = {"params": self._index["params"],
+                       "generation": self._index.get("generation", 0) + 1,
+                       "shards": [], "videos": {}}
+        try:
+            for name in video_names:
+                entry = dict((k, v) for k, v in videos[name].iteritems() if k != "clips")
+                records_bytes = []
+                for shard_idx, offset in videos[name]["clips"]:
+                    if shard_idx not in old_files:
+                        old_files[shard_idx] = open(old_paths[shard_idx], 'rb')
+                    old_files[shard_idx].seek(offset)
+                    records_bytes.append(old_files[shard_idx].read(self._record_bytes))
+                self._append_records(name, entry, records_bytes)
+            self.close()
+        finally:
+            for f in old_files.values():
+                f.close()
+        
+        new_paths = set(self.shard_paths)
+        for path in old_paths:
+            if path not in new_paths and os.path.isfile(path):
+                os.remove(path)
+    
+    def records(self, video_name):
+        """Gets the (shard_path, offset) records of the clips of a video."""
+        shards = self._index["shards"]
+        return [(os.path.join(self._full_path, shards[shard_idx]["name"]), offset)
+                for shard_idx, offset in self._index["videos"][video_name]["clips"]]
+    
+    def commit(self):
+        """Writes the index, after all appended records have been flushed."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        _write_manifest(self._index_path, self._index)
+        self._uncommitted = 0
+        
+    def close(self):
+        """Commits the index and closes the current shard file."""
+        self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    @property
+    def shard_paths(self):
+        """Gets the paths of all shard files."""
+        return [os.path.join(self._full_path, shard["name"]) for shard in self._index["shards"]]
+
+
 def preprocess_videos(dataset_path, subdir, file_list, image_size, serialized_sequence_length,
-                      gray_scale=False, scale_factor=1.0):
+                      gray_scale=False, scale_factor=1.0, num_workers=None, shard_size=None):
     """Serializes frame sequences from a given list of videos to the specified directories,
        or retrieves the list of existing files if these already exist.
+       For each video, a manifest file is written that records the source file and the
+       produced sequence files. Videos with a valid manifest are skipped, so that an
+       interrupted preprocessing continues where it stopped.
     Parameters
     ----------
     dataset_path: str
@@ -123,7 +493,7 @@ def preprocess_videos(dataset_path, subdir, file_list, image_size, serialized_se
         The subdir, basically to seperate training, validation and test data.
         It is recommended to use the constants, e.g tt.utils.data.SUBDIR_TRAIN.
     file_list: list(str)
-        The list of all files, using the relative file path.
+        The list of all files, using the file path relative to the dataset path.
     image_size: int list or tuple of shape [h, w, c]
         The image shape of the video data. All videos will be cropped or padded relative
         to this value.
@@ -133,12 +503,27 @@ def preprocess_videos(dataset_path, subdir, file_list, image_size, serialized_se
         dismissed.
     scale_factor: float in range (0.0, 1.0]
         The scale factor of the video. Take care to use a factor that resizes the video evenly.
+    num_workers: int or None, optional
+        The number of processes to decode the videos. Use None to use all CPUs.
+    shard_size: int or None, optional
+        The maximum size in bytes of a shard file. When set, the frame sequences are
+        appended as fixed-length records to a few large shard files, instead of writing
+        one .seq file per sequence. A single index file replaces the per-video manifests.
+        The shards are compacted to contain the sequences of the listed videos only.
+        Use None to write one .seq file per sequence.
     Returns
     ----------
-    (dataset_size, seq_file_list): as type (int, list(str)).
+    (dataset_size, seq_file_list): as type (int, list(str)) or (int, list(tuple(str, int))).
         The dataset size and a list with the path to the serialized sequence bundles.
+        In case shards are used, the list contains (shard_path, offset) tuples, where the
+        offset is the position of the sequence in the shard file in bytes.
     """
     assert scale_factor > 0 and scale_factor <= 1, "Scale factor has to be in range (0.0, 1.0]."
+    assert shard_size is None or shard_size > 0, "Shard size has to be positive."
+    
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    assert num_workers > 0, "At least one worker is required."
     
     target_size = [int(image_size[0] * scale_factor),
                    int(image_size[1] * scale_factor),
@@ -148,60 +533,141 @@ def preprocess_videos(dataset_path, subdir, file_list, image_size, serialized_se
     # previous preprocessing does not have to be deleted
     image_prop_dir = "{}_{}_{}".format(target_size[0], target_size[1], target_size[2])
     full_path = os.path.join(dataset_path, subdir, image_prop_dir)
-    seq_file_list = tt.utils.path.get_filenames(full_path, '*.seq')
-    
-    # Reuse previous preprocessing if possible
-    files_count = len(seq_file_list)
-    if files_count > 0:
-        print("Found {} serialized frame sequences. Skipping serialization.".format(files_count))
-        return files_count, seq_file_list          
                 
     # create subdir folder that will contain the .seq files
     if not os.path.exists(full_path):
-        os.makedirs(full_path)            
+        os.makedirs(full_path)
     
-    print("Serializing frame sequences to '{}'...".format(full_path))
-    success_counter = 0
-    short_counter = 0
-    progress = tt.utils.ui.ProgressBar(len(file_list))
+    params = {"serialized_sequence_length": serialized_sequence_length,
+              "gray_scale": bool(gray_scale),
+              "scale_factor": scale_factor}
+    
+    # fast path: reuse the sequence list of a previous complete run, as long as
+    # the params, the video list and the directory modification times are unchanged
+    summary_path = full_path + SUMMARY_POSTFIX
+    summary_key = {"params": dict(params, frame_shape=target_size, shard_size=shard_size),
+                   "file_list": hashlib.md5("\n".join(file_list)).hexdigest()}
+    summary_dirs = set([full_path])
+    summary_dirs.update([os.path.dirname(os.path.join(dataset_path, f)) for f in file_list])
+    
+    summary = _read_manifest(summary_path)
+    if summary is not None and summary.get("key") == summary_key and \
+       tt.utils.path.get_mtimes(summary["dirs"].keys()) == summary["dirs"]:
+        seq_file_list = summary["sequences"]
+        if shard_size is not None:
+            seq_file_list = [tuple(record) for record in seq_file_list]
+        print("Found {} serialized frame sequences. Skipping serialization.".format(len(seq_file_list)))
+        return len(seq_file_list), seq_file_list
+    
+    shard_writer = None
+    if shard_size is not None:
+        shard_writer = _ShardWriter(full_path, dict(params, frame_shape=target_size), shard_size)
+    
+    # reuse previous preprocessing if the manifest matches the source video and params
+    clips_list = [None] * len(file_list)
+    video_names = [None] * len(file_list)
+    pending = []
     for i, filename in enumerate(file_list):
-        with tt.utils.video.VideoReader(filename) as vr:
-            # until we reach the end of the video
-            clip_id = 0
-            while True:
-                frames = []
-                if vr.frames_left >= serialized_sequence_length:
-                    for f in xrange(serialized_sequence_length):
-                        frame = vr.next_frame(scale_factor)
-
-                        if frame is None:
-                            break
-                        
-                        # ensure bounds
-                        frame = tt.utils.image.pad_or_crop(frame, target_size, pad_value=0.0,
-                                                           ensure_copy=False)
-                        
-                        # convert to gray if requried
-                        if gray_scale == 1:
-                            frame = tt.utils.image.to_grayscale(frame)
-                            
-                        frames.append(frame)
-
-                if len(frames) == serialized_sequence_length:
-                    filename = os.path.basename(filename)
-                    filename_seq = "{}-{}.seq".format(os.path.splitext(filename)[0], clip_id)
-                    filepath_seq = os.path.join(full_path, filename_seq)
-                    tt.utils.image.write_as_binary(filepath_seq, np.asarray(frames))
-                    success_counter += 1
-                    clip_id += 1
+        video_path = os.path.join(dataset_path, filename)
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        video_names[i] = video_name
+        statinfo = os.stat(video_path)
+        source = {"source_mtime": statinfo.st_mtime,
+                  "source_size": statinfo.st_size}
+        
+        if shard_writer is not None:
+            existing = shard_writer.get(video_name)
+            if existing is not None and \
+               all(existing.get(k) == v for k, v in source.iteritems()):
+                clips_list[i] = shard_writer.records(video_name)
+            else:
+                pending.append((i, video_name, source,
+                                (video_path, target_size, serialized_sequence_length,
+                                 gray_scale, scale_factor)))
+            continue
+        
+        manifest = dict(source, **params)
+        existing = _read_manifest(os.path.join(full_path, video_name + MANIFEST_POSTFIX))
+        if existing is not None and "clips" in existing and \
+           all(existing.get(k) == v for k, v in manifest.iteritems()):
+            clips_list[i] = [os.path.join(full_path, c) for c in existing["clips"]]
+        else:
+            pending.append((i, video_name, source,
+                            (video_path, full_path, manifest, target_size,
+                             serialized_sequence_length, gray_scale, scale_factor)))
+    
+    if len(pending) == 0:
+        print("Found {} serialized videos. Skipping serialization.".format(len(file_list)))
+    else:
+        print("Serializing frame sequences of {} videos ({} already done) to '{}' using {} workers..." \
+              .format(len(pending), len(file_list) - len(pending), full_path, num_workers))
+        
+        start_time = time.time()
+        frames_counter = 0
+        errors = []
+        progress = tt.utils.ui.ProgressBar(len(pending))
+        
+        worker_func = _serialize_video if shard_writer is None else _decode_video
+        pending_args = [args for _, _, _, args in pending]
+        
+        pool = None
+        if num_workers > 1:
+            pool = multiprocessing.Pool(num_workers)
+            results = pool.imap(worker_func, pending_args)
+        else:
+            results = (worker_func(args) for args in pending_args)
+        
+        try:
+            for n, (clips, frames_count, error) in enumerate(results):
+                i, video_name, source, _ = pending[n]
+                frames_counter += frames_count
+                if error is not None:
+                    errors.append(error)
+                elif shard_writer is not None:
+                    shard_writer.append(video_name, source, clips)
+                    clips_list[i] = shard_writer.records(video_name)
                 else:
-                    if clip_id == 0:
-                        # clip end reached in first run (video was not used at all!)
-                        short_counter += 1
-                    break
-        progress.update(i+1)
-    print("Successfully generated {} frame sequences. Too short: {}" \
-          .format(success_counter, short_counter))
-    
-    seq_file_list = tt.utils.path.get_filenames(full_path, '*.seq')
-    return success_counter, seq_file_list
\ No newline at end of file
+                    clips_list[i] = [os.path.join(full_path, c) for c in clips]
+                
+                elapsed = max(time.time() - start_time, 1e-6)
+                progress.update(n + 1, [("frames/s", frames_counter / elapsed)])
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if shard_writer is not None:
+                shard_writer.close()
+                
+        elapsed = max(time.time() - start_time, 1e-6)
+        print("Serialized {} videos in {:.1f}s ({:.2f} videos/s, {:.1f} frames/s)." \
+              .format(len(pending), elapsed, len(pending) / elapsed, frames_counter / elapsed))
+        
+        for error in errors:
+            print("Could not serialize video {}".format(error))
+    
+    if shard_writer is not None:
+        # the shards are read as a whole, so that they must only contain the records
+        # of the used videos, which is not the case after resume or a changed file list
+        used = [i for i in xrange(len(file_list)) if clips_list[i] is not None]
+        shard_writer.compact([video_names[i] for i in used])
+        for i in used:
+            clips_list[i] = shard_writer.records(video_names[i])
+    
+    seq_file_list = []
+    short_counter = 0
+    for clips in clips_list:
+        if clips is None:
+            continue
+        if len(clips) == 0:
+            # video was too short and was not used at all
+            short_counter += 1
+        seq_file_list.extend(clips)
+    
+    if all(clips is not None for clips in clips_list):
+        # mark the preprocessing as complete
+        _write_manifest(summary_path, {"key": summary_key,
+                                       "dirs": tt.utils.path.get_mtimes(summary_dirs),
+                                       "sequences": seq_file_list})
+    
+    print("Using {} frame sequences. Too short: {}".format(len(seq_file_list), short_counter))
+    return len(seq_file_list), seq_file_list
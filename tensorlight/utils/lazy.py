@@ -0,0 +1,67 @@
+import sys
+import types
+import importlib
+import subprocess
+
+
+class LazyModule(types.ModuleType):
+    """Module placeholder that imports the actual module on first attribute access.
+       This is used for submodules with heavy (optional) dependencies, so that these
+       are not imported with the package itself."""
+
+    def __init__(self, name):
+        """Creates a lazy module.
+        Parameters
+        ----------
+        name: str
+            The fully qualified name of the module, such as 'tensorlight.utils.video'.
+        """
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        """Imports the actual module, which replaces this placeholder in its parent package."""
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+            # keep references to this placeholder working without the indirection
+            self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__['_module'] is None:
+            return "<lazy module '{}'>".format(self.__name__)
+        return repr(self.__dict__['_module'])
+
+
+def import_time(module_name="tensorlight", repeats=3):
+    """Measures the time to import a module in a fresh interpreter, e.g. to guard
+       the startup time of processes against regressions of eager imports.
+    Parameters
+    ----------
+    module_name: str, optional
+        The name of the module to import.
+    repeats: int, optional
+        The number of repeated measurements.
+    Returns
+    ----------
+    The minimum import time in seconds.
+    """
+    statement = "import time; t = time.time(); import {}; print(time.time() - t)".format(module_name)
+    timings = []
+    for _ in xrange(repeats):
+        output = subprocess.check_output([sys.executable, "-c", statement])
+        timings.append(float(output.strip().splitlines()[-1]))
+    return min(timings)
+
+
+if __name__ == '__main__':
+    module_name = sys.argv[1] if len(sys.argv) > 1 else "tensorlight"
+    print("Import time of '{}': {:.3f}s".format(module_name, import_time(module_name)))
@@ -1,7 +1,12 @@
 import os
+import json
 import fnmatch
 
 
+# postfix of the file next to a directory that caches its file listing
+FILENAMES_CACHE_POSTFIX = ".filenames.json"
+
+
 def get_filenames(root_dir, pattern, include_root=True):
     """Gets a list of files of a given directory matching a
        specified pattern, by using a resursive search.
@@ -28,6 +33,89 @@ def get_filenames(root_dir, pattern, include_root=True):
     return matches
 
 
+def get_filenames_cached(root_dir, pattern, include_root=True):
+    """Gets a list of files of a given directory matching a specified pattern,
+       like get_filenames(). The result is cached in a file next to the directory,
+       which is reused as long as the modification time of none of the scanned
+       directories has changed. This happens when files are added, removed or renamed.
+    Parameters
+    ----------
+    root_dir: str
+        The directory to recursively look into.
+    pattern: str
+        The file pattern search string, such as '*.jpg'.
+    include_root: Boolean, optional
+        Whether to include the root path or just return the
+        filenames.
+    Returns
+    ----------
+    matches: list(string)
+        Returns a list of filenames that match this pattern.
+    """
+    root_dir = os.path.normpath(root_dir)
+    cache_path = root_dir + FILENAMES_CACHE_POSTFIX
+    
+    cache = None
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except ValueError:
+            pass
+    
+    dir_mtimes = None
+    if cache is not None:
+        dir_mtimes = dict((os.path.join(root_dir, d), mtime)
+                          for d, mtime in cache["dirs"].iteritems())
+    if cache is None or get_mtimes(dir_mtimes.keys()) != dir_mtimes:
+        cache = {"dirs": {}, "patterns": {}}
+    
+    if pattern not in cache["patterns"]:
+        relpaths = []
+        dirs = {}
+        for root, dirnames, filenames in os.walk(root_dir):
+            dirs[os.path.relpath(root, root_dir)] = os.path.getmtime(root)
+            for filename in fnmatch.filter(filenames, pattern):
+                relpaths.append(os.path.relpath(os.path.join(root, filename), root_dir))
+        
+        if dirs != cache["dirs"]:
+            # directories have changed while scanning, drop the listings of other patterns
+            cache = {"dirs": dirs, "patterns": {}}
+        cache["patterns"][pattern] = relpaths
+        
+        try:
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            print("Could not write file listing cache {}.".format(cache_path))
+    
+    relpaths = cache["patterns"][pattern]
+    if include_root:
+        return [os.path.join(root_dir, relpath) for relpath in relpaths]
+    return [os.path.basename(relpath) for relpath in relpaths]
+
+
+def get_mtimes(paths):
+    """Gets the modification times of files or directories.
+    Parameters
+    ----------
+    paths: list(str)
+        The paths to the files or directories.
+    Returns
+    ----------
+    A dict that maps each path to its modification time, or None for a missing path.
+    """
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
 def get_subdirnames(root_dir):
     """Gets the immediate subdirectory names of a folder.
     Parameters
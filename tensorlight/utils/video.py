@@ -11,7 +11,12 @@ from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
 
 class VideoReader():
     """Video file reader class using OpenCV."""
-    def __init__(self, filename, start_frame=0):
+    # container formats without a frame index, whose reported frame count is only
+    # estimated, so that the frames are counted by reading the stream until its end.
+    # Other formats rely on the reported count, which is corrected while reading
+    INEXACT_FRAME_COUNT_FORMATS = ['.mpg', '.mpeg', '.vob', '.ts']
+    
+    def __init__(self, filename, start_frame=0, streaming=False):
         """Creates a VideoReader instance.
         Parameters
         ----------
@@ -19,15 +24,24 @@ class VideoReader():
             The file path to the video.
         start_frame: int, optional
             The frame where to start the video.
+        streaming: Boolean, optional
+            Whether to decode the frames lazily one by one, instead of loading the
+            whole video into memory. This keeps the memory usage bounded for long videos.
+            Note: Skipped frames are decoded as well, and going back to a previous frame
+                  decodes the video again from its first frame, to be frame-accurate.
         """
         if not os.path.isfile(filename):
             print("Video file {} not found.".format(filename))
         
         self._filename = filename
+        self._streaming = streaming
         
         # load the video data
         self._video = None
-        if self._video is None:
+        self._capture = None
+        if streaming:
+            self._open_capture()
+        elif self._video is None:
             self.read_video()
 
         # select the start frame
@@ -52,10 +66,14 @@ class VideoReader():
         image: ndarray(uint8)
             Returns an ndarray of the image or None in case of an error.
         """
-        if self._video is None or self._video.shape[0] <= self._frame_idx:
-            return None
-        
-        frame = self._video[self._frame_idx]
+        if self._streaming:
+            frame = self._next_streamed_frame()
+            if frame is None:
+                return None
+        else:
+            if self._video is None or self._video.shape[0] <= self._frame_idx:
+                return None
+            frame = self._video[self._frame_idx]
         self._frame_idx += 1
         
         frame = tt.utils.image.resize(frame, scale)
@@ -69,6 +87,61 @@ class VideoReader():
             else:
                 self._video = video
         return self._video
+    
+    def _open_capture(self):
+        """Opens the video for streaming and determines its frame count."""
+        self._reset_capture()
+        # the frame count of the container might be too large, which is corrected
+        # as soon as the stream ends too early, or too small, which is corrected
+        # as soon as the stream continues
+        frames_length = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        extension = os.path.splitext(self._filename)[1].lower()
+        if frames_length <= 0 or extension in VideoReader.INEXACT_FRAME_COUNT_FORMATS:
+            frames_length = 0
+            while self._capture.grab():
+                frames_length += 1
+            self._reset_capture()
+        self._frames_length = frames_length
+    
+    def _reset_capture(self):
+        """(Re-)opens the video stream at its first frame."""
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        capture = cv2.VideoCapture(self._filename)
+        if not capture.isOpened():
+            raise IOError("Could not load video file.")
+        self._capture = capture
+        self._capture_idx = 0
+    
+    def _next_streamed_frame(self):
+        """Decodes the frame at the current frame index from the stream.
+        Returns
+        ----------
+        The RGB frame as ndarray(uint8) or None when the end of the video is reached.
+        """
+        if self._capture is None:
+            return None
+        
+        # seeking is not frame-accurate for many codecs, because the decoder can only
+        # jump to keyframes, so that the frames in between are decoded and dropped
+        if self._frame_idx < self._capture_idx:
+            self._reset_capture()
+        while self._capture_idx < self._frame_idx:
+            if not self._capture.grab():
+                self._frames_length = self._capture_idx
+                return None
+            self._capture_idx += 1
+        
+        success, frame = self._capture.read()
+        if not success:
+            self._frames_length = self._frame_idx
+            return None
+        self._capture_idx += 1
+        self._frames_length = max(self._frames_length, self._capture_idx)
+        
+        # OpenCV decodes to BGR
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         
     def skip_frames(self, count=1):
         """Skips the next frames from the video.
@@ -80,17 +153,24 @@ class VideoReader():
         self.goto_frame(self._frame_idx + count)
                 
     def goto_frame(self, frame_idx):
-        """Go to a specific frame."""
+        """Go to a specific frame.
+           Note: In streaming mode, going back to a previous frame re-opens the video
+                 and decodes all frames up to the given one."""
         self._frame_idx = frame_idx
         
     def release(self):
         """Releases the video file resources."""
         if self._video is not None:
             del self._video
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
     
     @property
     def frames_length(self):
         """Returns the total frames length of the video."""
+        if self._streaming:
+            return self._frames_length
         return self._video.shape[0]
     
     @property